@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import argparse
+
+import instrument
+from generate import StageJob, run_jobs, get_atom, STAGES, DEFAULT_OUTPUT
+
+# Batch generation of the data files of several species and parameter sets.
+#
+# Every parameter set (a run) writes "levels.dat", "absorption.dat", "spontaneous.dat"... into its own
+# directory, by default <root>/<atom>, that path-select.py and plot.py take as argument, e.g.
+#   python path-select.py data/Caesium
+# The blocks of all runs share one process pool: the levels of all runs are computed first, so that
+# they are available early, then the transition stages run by run, so that the runs complete in order.
+#
+#### Batch file (JSON) ####
+# {"root": "data",
+#  "runs": [{"atom": "Rubidium85", "n_max": 40},
+#           {"atom": "Rubidium87", "n_max": 40, "q": 0},
+#           {"atom": "Caesium", "n_start": 6, "n_max": 40, "temperature": 77, "directory": "data/Cs-77K"}]}
+# run keys: atom, directory, stages, n_start (default: the ground state n of the atom), n_max, l_max,
+# q, method, temperature, temperatures (see generate.py)
+
+RUN_KEYS = ['atom', 'directory', 'stages', 'n_start', 'n_max', 'l_max', 'q', 'method', 'temperature', 'temperatures']
+
+DEFAULT_STAGES = ['levels', 'absorption', 'spontaneous']
+
+def get_runs(runs, root='data'):
+    # complete the runs with their directory, stages and n_start, and check them
+    complete = []
+    directories = set()
+    for run in runs:
+        unknown = set(run) - set(RUN_KEYS)
+        if unknown:
+            raise ValueError('unknown keys of run %s: %s' % (run.get('atom'), ', '.join(sorted(unknown))))
+        if 'atom' not in run:
+            raise ValueError('run without atom: %s' % json.dumps(run))
+        # every species is checked before any job starts (ValueError for an unknown name)
+        atom = get_atom(run['atom'])
+        if run.get('q', 1) not in (-1, 0, 1):
+            raise ValueError('invalid polarization q=%s of run %s, expected -1, 0 or 1' % (run['q'], run['atom']))
+        run = dict(run)
+        run.setdefault('directory', os.path.join(root, run['atom']))
+        run.setdefault('stages', DEFAULT_STAGES)
+        if 'n_start' not in run:
+            run['n_start'] = atom.groundStateN
+        for stage in run['stages']:
+            if stage not in STAGES:
+                raise ValueError('unknown stage: ' + stage)
+        if run['directory'] in directories:
+            raise ValueError('two runs write into ' + run['directory'])
+        directories.add(run['directory'])
+        complete.append(run)
+    return complete
+
+def get_jobs(runs, rebuild=False, cache=None, cache_size=5000000, verbose=True):
+    # levels of all runs first, then the other stages run by run
+    order = [(run, stage) for run in runs for stage in run['stages'] if stage == 'levels']
+    order += [(run, stage) for run in runs for stage in run['stages'] if stage != 'levels']
+    jobs = []
+    for run, stage in order:
+        os.makedirs(run['directory'], exist_ok=True)
+        params = {k: v for k, v in run.items() if k in ['n_start', 'n_max', 'l_max', 'q', 'method',
+                                                         'temperature', 'temperatures']}
+        jobs.append(StageJob(stage, os.path.join(run['directory'], DEFAULT_OUTPUT[stage]), run['atom'],
+                             rebuild=rebuild, cache=cache, cache_size=cache_size, verbose=verbose, **params))
+    return jobs
+
+def batch(runs, root='data', processes=None, rebuild=False, cache=None, cache_size=5000000, verbose=True):
+    # cache: SQLite cache of ARC quantities shared by all runs, by default <root>/arc_cache.sqlite
+    runs = get_runs(runs, root)
+    if cache is None:
+        os.makedirs(root, exist_ok=True)
+        cache = os.path.join(root, 'arc_cache.sqlite')
+    jobs = get_jobs(runs, rebuild, cache, cache_size, verbose)
+    n_rows = run_jobs(jobs, processes, cache, cache_size, verbose)
+    return {(job.atom_name, job.output): n for job, n in zip(jobs, n_rows)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the data files of several species in one process pool.')
+    parser.add_argument('species', nargs='*', help='names of ARC atom classes, e.g. Rubidium85 Rubidium87 Caesium')
+    parser.add_argument('--config', default=None, help='batch file (JSON) of runs, see batch.py')
+    parser.add_argument('--root', default=None, help='directory of the per-species directories (default: data)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=DEFAULT_STAGES)
+    parser.add_argument('--n-start', type=int, default=None, help='default: the ground state n of every atom')
+    parser.add_argument('--n-max', type=int, default=30)
+    parser.add_argument('--l-max', type=int, default=4)
+    parser.add_argument('-q', type=int, choices=(-1, 0, 1), default=+1, help='polarization of the driving field')
+    parser.add_argument('-T', '--temperature', type=float, default=300, help='temperature (K) of spontaneous rates')
+    parser.add_argument('--temperatures', type=float, nargs='+', default=None, help='temperatures (K) of the sweep stage')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--rebuild', action='store_true', help='discard the stored blocks of these parameters')
+    parser.add_argument('--cache', default=None, help='SQLite cache of ARC quantities (default: <root>/arc_cache.sqlite)')
+    parser.add_argument('--cache-size', type=int, default=5000000, help='maximum number of cached values')
+    parser.add_argument('--quiet', action='store_true')
+    parser.add_argument('--instrument', nargs='?', const='1', default=None,
+                        help='log timers and counters as JSON lines, to stderr or to the given file (see instrument.py)')
+    parser.add_argument('--profile', default=None, help='write a cProfile of the run (and <file>.<pid> of the workers)')
+    args = parser.parse_args(argv)
+    instrument.configure(args.instrument, args.profile)
+
+    root = 'data'
+    runs = []
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        root = config.get('root', root)
+        runs += config['runs']
+    for atom in args.species:
+        run = {'atom': atom, 'stages': args.stages, 'n_max': args.n_max, 'l_max': args.l_max, 'q': args.q,
+               'temperature': args.temperature, 'temperatures': args.temperatures}
+        if args.n_start is not None:
+            run['n_start'] = args.n_start
+        runs.append(run)
+    if not runs:
+        parser.error('give species or a --config file')
+    if args.root:
+        root = args.root
+    try:
+        batch(runs, root, args.processes, args.rebuild, args.cache, args.cache_size, not args.quiet)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+import numpy as np
+from scipy.constants import pi, hbar, e as C_e, h as C_h, c as C_c, epsilon_0, physical_constants
+
+from generate import generate, get_spherical_factors, get_blackbody_rates, DEFAULT_OUTPUT
+from datafile import convert
+from dataset import Dataset, normalize, get_paths
+from transitionstore import TransitionStore
+from coveragemap import compute_coverage
+from schemes import SchemeEvaluator
+
+# Benchmarks of generation, loading, querying and rendering on synthetic datasets.
+#
+# For every size (n_max), the data files are generated by generate.py with SyntheticAtom, an offline
+# stand-in for the ARC atom with the same methods, so that the files have the layouts and the row counts
+# of real ones (same states, selection rules and cutoffs) without ARC. Then every step of the tools is
+# timed on them: text to binary conversion, normalization (the state IDs that replaced the reordering of
+# the rows), loading and indexing, frequency-window and per-state queries, the coverage map, the tables
+# and the canvas of path-select.py (offscreen Qt) and the figures of plot.py (Agg).
+#
+#   python benchmark.py --sizes 30 40 60 80 -o bench.json
+#
+# The results are written as JSON, one record per (n_max, benchmark) with the median, min and max
+# time of the repeats in seconds, and the number of rows when it applies.
+
+a0 = physical_constants['Bohr radius'][0]
+
+RYDBERG_EV = 13.605693
+# Rb-like quantum defects of l = s, p, d, f, and of the fine structure
+QUANTUM_DEFECTS = [3.1311, 2.6548, 1.3480, 0.0165]
+FINE_STRUCTURE_DEFECT = 0.01
+
+SIZES = [30, 40, 60, 80]
+
+class SyntheticAtom():
+    # Offline stand-in of an ARC atom for generate.py: energies from the Rydberg formula with quantum
+    # defects and smooth model matrix elements. The values are not physical, only the data they give has
+    # realistic shape: the same states, lines and signs as from ARC.
+    groundStateN = 5
+
+    def get_n_eff(self, n, l, j):
+        defect = QUANTUM_DEFECTS[l] if l < len(QUANTUM_DEFECTS) else 0.0
+        return n - defect - FINE_STRUCTURE_DEFECT * (l + 0.5 - j) / (l + 1)
+
+    def getEnergy(self, n, l, j):
+        return -RYDBERG_EV / self.get_n_eff(n, l, j)**2
+
+    def getStateLifetime(self, n, l, j):
+        return 1e-9 * (l + 1) * self.get_n_eff(n, l, j)**3
+
+    def getTransitionFrequency(self, n1, l1, j1, n2, l2, j2):
+        return (self.getEnergy(n2, l2, j2) - self.getEnergy(n1, l1, j1)) * C_e / C_h
+
+    def getTransitionWavelength(self, n1, l1, j1, n2, l2, j2):
+        return C_c / self.getTransitionFrequency(n1, l1, j1, n2, l2, j2)
+
+    def getReducedMatrixElementJ(self, n1, l1, j1, n2, l2, j2):
+        # ~n^2 a0*e between neighbouring levels, decreasing with the distance of the effective n;
+        # 0 unless l2 = l1 +- 1, as the angular factor of ARC (parity)
+        if abs(l1 - l2) != 1:
+            return 0.0
+        n_eff1, n_eff2 = self.get_n_eff(n1, l1, j1), self.get_n_eff(n2, l2, j2)
+        radial = 0.75 * (n_eff1**2 + n_eff2**2) / (1 + (n_eff1 - n_eff2)**2)
+        return (-1)**int(n1 + n2) * np.sqrt(max(l1, l2)) * radial
+
+    def getDipoleMatrixElement(self, n1, l1, j1, mj1, n2, l2, j2, mj2, q):
+        if mj2 - mj1 != q:
+            return 0.0
+        return float(get_spherical_factors(j1, mj1, j2, q) * self.getReducedMatrixElementJ(n1, l1, j1, n2, l2, j2))
+
+    def getTransitionRate(self, n1, l1, j1, n2, l2, j2, temperature=0):
+        # Einstein coefficient of the reduced matrix element, times 1 + the thermal occupation as ARC
+        frequency = self.getTransitionFrequency(n1, l1, j1, n2, l2, j2)
+        dipole = self.getReducedMatrixElementJ(n1, l1, j1, n2, l2, j2) * C_e * a0
+        omega = 2 * pi * abs(frequency)
+        rate = omega**3 * dipole**2 / (3 * pi * epsilon_0 * hbar * C_c**3 * (2*j1 + 1))
+        return float(get_blackbody_rates([frequency], [rate], [temperature])[0, 0])
+
+def make_dataset(directory, n_max, n_start=5, l_max=4, method='mj', processes=None):
+    # the three data files and their binary twins; returns the generation time of every stage
+    os.makedirs(directory, exist_ok=True)
+    times = {}
+    for stage in ['levels', 'absorption', 'spontaneous']:
+        t0 = time.perf_counter()
+        generate(stage, os.path.join(directory, DEFAULT_OUTPUT[stage]), 'benchmark.SyntheticAtom', n_start, n_max,
+                 l_max, method=method, processes=processes, rebuild=True, cache=None, verbose=False)
+        times[stage] = time.perf_counter() - t0
+    return times
+
+def measure(function, repeat=5):
+    # seconds of every call, and the result of the last one
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t0)
+    return times, result
+
+def import_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark():
+    # runs the benchmarks of every size and collects the records
+
+    def __init__(self, root, repeat=5, n_queries=200, processes=None, method='mj', regenerate=True):
+        self.root = root
+        self.repeat = repeat
+        self.n_queries = n_queries
+        self.processes = processes
+        self.method = method
+        self.regenerate = regenerate
+        self.records = []
+        self.gui = None
+        self.plot = None
+
+    def add(self, n_max, name, times, rows=None):
+        record = {'n_max': n_max, 'benchmark': name, 'repeat': len(times), 'median': float(np.median(times)),
+                  'min': float(np.min(times)), 'max': float(np.max(times))}
+        if rows is not None:
+            record['rows'] = int(rows)
+        self.records.append(record)
+        print('n_max %3d  %-28s %10.4f s%s' % (n_max, name, record['median'],
+                                             '' if rows is None else '  (%d rows)' % rows), file=sys.stderr, flush=True)
+
+    def run(self, sizes):
+        for n_max in sizes:
+            self.run_size(n_max)
+        return self.records
+
+    def run_size(self, n_max):
+        directory = os.path.join(self.root, 'n%d' % n_max)
+        paths = get_paths(directory)
+        if self.regenerate or not all(os.path.exists(paths[name]) for name in ['levels', 'absorption', 'spontaneous']):
+            for stage, seconds in make_dataset(directory, n_max, method=self.method, processes=self.processes).items():
+                self.add(n_max, 'generate.' + stage, [seconds])
+
+        # text to binary, and the normalized files (state IDs)
+        for kind in ['levels', 'absorption', 'spontaneous']:
+            times, _ = measure(lambda: convert(paths[kind], kind=kind), self.repeat)
+            self.add(n_max, 'convert.' + kind, times)
+
+        def run_normalize():
+            os.remove(paths['states'])
+            normalize(directory)
+        normalize(directory)
+        times, _ = measure(run_normalize, self.repeat)
+        self.add(n_max, 'normalize', times)
+
+        times, dataset = measure(lambda: Dataset(directory, indexes=False), self.repeat)
+        self.add(n_max, 'load', times, len(dataset.absp) + len(dataset.spon))
+        times, _ = measure(dataset.build_indexes, self.repeat)
+        self.add(n_max, 'index', times)
+        self.run_queries(n_max, directory, dataset)
+        self.run_gui(n_max, dataset)
+        self.run_figures(n_max, directory)
+
+    def run_queries(self, n_max, directory, dataset):
+        absorption, spontaneous = TransitionStore(dataset, 'absorption'), TransitionStore(dataset, 'spontaneous')
+        times, (rows, _) = measure(lambda: absorption.select(freq=(0.1, 3.0)), self.repeat)
+        self.add(n_max, 'query.window', times, len(rows))
+        scan = TransitionStore(Dataset(directory, indexes=False), 'absorption')
+        times, (rows, _) = measure(lambda: scan.select(freq=(0.1, 3.0)), self.repeat)
+        self.add(n_max, 'query.window.scan', times, len(rows))
+
+        # per-state queries of the GUI tables, on a fixed sample of levels; time per query
+        rng = np.random.default_rng(0)
+        lines = dataset.absp[rng.choice(len(dataset.absp), min(self.n_queries, len(dataset.absp)), replace=False)]
+        def query_absorption():
+            for line in lines:
+                absorption.select(upper=int(line['upper']), two_mj_upper=int(line['two_mj_upper']))
+        times, _ = measure(query_absorption, self.repeat)
+        self.add(n_max, 'query.state.absorption', np.array(times) / max(len(lines), 1))
+        upper = rng.choice(np.unique(dataset.spon['upper']), min(self.n_queries, len(dataset.states)))
+        def query_spontaneous():
+            for state_id in upper:
+                spontaneous.select(upper=int(state_id))
+        times, _ = measure(query_spontaneous, self.repeat)
+        self.add(n_max, 'query.state.spontaneous', np.array(times) / max(len(upper), 1))
+
+        times, coverage = measure(lambda: compute_coverage(dataset), self.repeat)
+        self.add(n_max, 'coverage', times, coverage['count'].sum())
+
+        # one-step schemes of random absorption rows, detected from their upper level
+        evaluator = SchemeEvaluator(dataset)
+        lines = dataset.absp[rng.choice(len(dataset.absp), 10000)]
+        ladder = np.stack([lines['lower'], lines['upper']], axis=1)
+        two_mj = np.stack([lines['two_mj_lower'], lines['two_mj_upper']], axis=1)
+        times, results = measure(lambda: evaluator.rank(evaluator.evaluate(ladder, two_mj, bands=[(700, 900)])), self.repeat)
+        self.add(n_max, 'schemes.evaluate', times, len(results))
+
+    def get_gui(self):
+        # path-select.py, imported once with an offscreen Qt application
+        if self.gui is None:
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+            from PyQt5.QtWidgets import QApplication
+            self.app = QApplication.instance() or QApplication([])
+            self.gui = import_module('path_select', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'path-select.py'))
+        return self.gui
+
+    def run_gui(self, n_max, dataset):
+        gui = self.get_gui()
+        gui.dataset = dataset
+        header = ['n_lower', 'l_lower', 'j_lower', 'mj_lower', 'n_upper', 'l_upper', 'j_upper', 'mj_upper', 'Freq. (THz)', 'dipole']
+        _, lines = TransitionStore(dataset, 'absorption').select()
+        table = gui.absorption_table(lines, 'freq')
+        dialog = gui.TableWidget(None)
+        def fill_table():
+            dialog.update_data(table, header)
+            dialog.grab()
+        times, _ = measure(fill_table, self.repeat)
+        self.add(n_max, 'gui.table', times, len(table))
+        def sort_table():
+            dialog.model.sort(8)
+            dialog.grab()
+        times, _ = measure(sort_table, self.repeat)
+        self.add(n_max, 'gui.table.sort', times, len(table))
+
+        def draw_levels():
+            canvas = gui.PlotCanvas()
+            canvas.plot_levels(dataset.states)
+            canvas.draw()
+            return canvas
+        times, _ = measure(draw_levels, self.repeat)
+        self.add(n_max, 'gui.canvas', times, len(dataset.states))
+
+    def get_plot(self):
+        # plot.py, headless
+        if self.plot is None:
+            import plot
+            plot._init_renderer()
+            logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+            self.plot = plot
+        return self.plot
+
+    def run_figures(self, n_max, directory):
+        # figures drawn and saved as by plot.py --render
+        plot = self.get_plot()
+        for figure in ['absorption', 'diagram', 'coverage']:
+            output = os.path.join(directory, figure + '.png')
+            times, _ = measure(lambda: plot.render_figure({'figure': figure, 'directory': directory, 'output': output}),
+                               self.repeat)
+            self.add(n_max, 'figure.' + figure, times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic datasets.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='n_max of the datasets')
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'arc-calculator-benchmark'),
+                        help='directory of the synthetic datasets')
+    parser.add_argument('--reuse', action='store_true', help='keep existing datasets instead of generating them')
+    parser.add_argument('--method', choices=['mj', 'reduced'], default='mj', help='method of the absorption stage')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200, help='number of per-state queries')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes of generation')
+    parser.add_argument('-o', '--output', default=None, help='JSON file of the results (default: standard output)')
+    parser.add_argument('--clean', action='store_true', help='remove the datasets at the end')
+    args = parser.parse_args(argv)
+
+    benchmark = Benchmark(args.root, args.repeat, args.queries, args.processes, args.method, not args.reuse)
+    t0 = time.time()
+    records = benchmark.run(args.sizes)
+    results = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t0)), 'commit': get_git_commit(),
+                        'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'repeat': args.repeat, 'method': args.method},
+               'results': records}
+    text = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.clean:
+        shutil.rmtree(args.root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import hashlib
+
+try:
+    import fcntl
+except ImportError:
+    # no lock of the store (Windows): chunk files left by interrupted runs are kept
+    fcntl = None
+
+# Persistent store of generated blocks, so that generation is incremental and resumable.
+#
+# Every stage is split into small blocks, e.g. (n1, l1, n2, l2) for "absorption.dat". Workers write
+# the lines of several blocks into one chunk file; the manifest records, for every block, the chunk
+# file and the byte range of its lines. Blocks are stored per parameter set (atom, q, temperature...)
+# in a subdirectory named by the hash of the parameters, and the output file is assembled by copying
+# the byte ranges of the requested blocks in sorted block order.
+#
+#### Layout of the store ####
+# <output>.blocks/<params hash>/manifest.json
+# <output>.blocks/<params hash>/lock
+# <output>.blocks/<params hash>/<chunk files>
+#
+# Every run holds a shared lock on the "lock" file while it uses the store; the chunk files that are
+# not in the manifest are only removed by a run that can lock the store exclusively, i.e. when no
+# other run is writing chunks into it.
+
+MANIFEST = 'manifest.json'
+LOCK = 'lock'
+
+def get_params_hash(stage, params):
+    text = json.dumps({'stage': stage, 'params': params}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+class BlockStore():
+
+    def __init__(self, root, stage, params, checkpoint_interval=10):
+        self.stage = stage
+        self.params = params
+        self.directory = os.path.join(root, get_params_hash(stage, params))
+        self.checkpoint_interval = checkpoint_interval
+        self.blocks = {}
+        self._last_checkpoint = time.time()
+        self._lock = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            for key, chunk, offset, length, rows in manifest['blocks']:
+                self.blocks[tuple(key)] = (chunk, offset, length, rows)
+        if fcntl is None:
+            return
+        self._lock = open(os.path.join(self.directory, LOCK), 'a')
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # another run is active: its chunk files are not in the manifest yet
+            pass
+        else:
+            # chunk files that are not in the manifest were left by an interrupted run
+            chunks = set(chunk for chunk, _, _, _ in self.blocks.values())
+            for name in os.listdir(self.directory):
+                if name not in [MANIFEST, LOCK] and name not in chunks:
+                    os.remove(os.path.join(self.directory, name))
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+
+    def close(self):
+        # release the lock of the store (closing the file releases it)
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def missing(self, keys):
+        return [key for key in keys if key not in self.blocks]
+
+    def get_chunk_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def add_chunk(self, name, records):
+        # records: list of (key, offset, length, rows) of the blocks written to the chunk file
+        for key, offset, length, rows in records:
+            self.blocks[tuple(key)] = (name, offset, length, rows)
+        if time.time() - self._last_checkpoint > self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        path = os.path.join(self.directory, MANIFEST)
+        manifest = {'stage': self.stage, 'params': self.params,
+                    'blocks': [[list(key)] + list(value) for key, value in sorted(self.blocks.items())]}
+        # temporary file per process, as concurrent runs of the store checkpoint independently
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+        self._last_checkpoint = time.time()
+
+    def count_rows(self, keys):
+        return sum(self.blocks[key][3] for key in keys)
+
+    def write_output(self, keys, output):
+        # copy the lines of the blocks in sorted order, which is the order of the serial loops
+        files = {}
+        try:
+            with open(output + '.tmp', 'wb') as f:
+                for key in sorted(keys):
+                    chunk, offset, length, _ = self.blocks[key]
+                    if length == 0:
+                        continue
+                    if chunk not in files:
+                        files[chunk] = open(self.get_chunk_path(chunk), 'rb')
+                    files[chunk].seek(offset)
+                    f.write(files[chunk].read(length))
+        finally:
+            for chunk_file in files.values():
+                chunk_file.close()
+        os.replace(output + '.tmp', output)
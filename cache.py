@@ -0,0 +1,103 @@
+import time
+import sqlite3
+
+# Persistent cache of ARC quantities, shared by all generation stages and across runs.
+# Values are keyed by atom species, ARC method name and arguments (the state quantum numbers),
+# and live in a SQLite file; the least recently used entries are evicted beyond max_entries.
+
+CACHED_METHODS = ('getEnergy', 'getStateLifetime',
+                  'getTransitionFrequency', 'getTransitionWavelength', 'getTransitionRate',
+                  'getRadialMatrixElement', 'getReducedMatrixElementL', 'getReducedMatrixElementJ',
+                  'getDipoleMatrixElement')
+
+def get_key(species, name, args, kwargs):
+    # quantum numbers arrive as int, float or numpy scalars - normalize them so the key is stable
+    key = species + ':' + name + ':' + ','.join(repr(float(a)) for a in args)
+    for k in sorted(kwargs):
+        key += ',' + k + '=' + repr(float(kwargs[k]))
+    return key
+
+class CachedAtom():
+    # read-through proxy of an ARC atom: cached methods look up memory, then the database,
+    # and only call ARC on a miss; all other attributes are forwarded to the atom
+
+    def __init__(self, atom, path='arc_cache.sqlite', max_entries=5000000, max_memory=1000000, flush_every=1000):
+        self.atom = atom
+        self.species = type(atom).__name__
+        self.path = path
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = {}
+        self._pending = {}
+        self._touched = set()
+
+        self._conn = sqlite3.connect(path, timeout=600)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value REAL, last_used REAL)')
+        self._conn.commit()
+        (self._count,) = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()
+
+        for name in CACHED_METHODS:
+            if hasattr(atom, name):
+                setattr(self, name, self._make_cached(name))
+
+    def __getattr__(self, name):
+        return getattr(self.atom, name)
+
+    def _make_cached(self, name):
+        method = getattr(self.atom, name)
+
+        def cached(*args, **kwargs):
+            key = get_key(self.species, name, args, kwargs)
+            if key in self._memory:
+                self.hits += 1
+                return self._memory[key]
+            row = self._conn.execute('SELECT value FROM cache WHERE key=?', (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                self._touched.add(key)
+                value = row[0]
+            else:
+                self.misses += 1
+                value = float(method(*args, **kwargs))
+                self._pending[key] = value
+                if len(self._pending) >= self.flush_every:
+                    self.flush()
+            if len(self._memory) >= self.max_memory:
+                self._memory.clear()
+            self._memory[key] = value
+            return value
+
+        return cached
+
+    def flush(self):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                                   [(k, v, now) for k, v in self._pending.items()])
+            self._conn.executemany('UPDATE cache SET last_used=? WHERE key=?',
+                                   [(now, k) for k in self._touched])
+        self._count += len(self._pending)
+        self._pending = {}
+        self._touched = set()
+        if self._count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        # drop the least recently used entries down to 90% of max_entries
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self.max_entries:
+            with self._conn:
+                self._conn.execute('DELETE FROM cache WHERE key IN '
+                                   '(SELECT key FROM cache ORDER BY last_used LIMIT ?)',
+                                   (count - int(0.9 * self.max_entries),))
+            count = int(0.9 * self.max_entries)
+        self._count = count
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,105 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import expm_multiply
+
+# Cascades of spontaneous radiation.
+#
+# The rows of "spontaneous.dat" all go from a higher to a lower level, so they form a directed acyclic
+# graph ordered by energy. With the branching ratio of every row (its rate over the total rate out of
+# its upper level), a single pass over the levels in order of energy gives, for a starting level, the
+# fraction of the population that passes through every lower level and the number of photons emitted
+# on every transition; a pass in the opposite order gives these fractions for all starting levels.
+# Levels without spontaneous rows (e.g. the ground state) are the terminal levels of the cascades.
+
+class Cascade():
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        spon = dataset.spon
+        self.upper = np.asarray(spon['upper'], dtype=np.int64)
+        self.lower = np.asarray(spon['lower'], dtype=np.int64)
+        self.rate = np.asarray(spon['rate'])
+        self.n_states = len(dataset.states)
+        self.total_rate = np.bincount(self.upper, weights=self.rate, minlength=self.n_states)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.branching = self.rate / self.total_rate[self.upper]
+        # topological order of the levels: decreasing energy, levels of unknown energy (not in
+        # "levels.dat") last, which is only right for levels without spontaneous rows from them
+        energy = np.array(dataset.states['energy'])
+        unknown = np.isnan(energy) & (np.bincount(self.upper, minlength=self.n_states) > 0)
+        if np.any(unknown):
+            raise ValueError('spontaneous radiation from levels of unknown energy: ' +
+                             ', '.join(dataset.get_label(state_id) for state_id in np.nonzero(unknown)[0][:10]))
+        self.order = np.argsort(np.where(np.isnan(energy), np.inf, -energy), kind='stable')
+        self.position = np.empty(self.n_states, dtype=np.int64)
+        self.position[self.order] = np.arange(self.n_states)
+
+    def populations(self, start_id):
+        # fraction of the population of start_id passing through every level, and photons per
+        # spontaneous row (the flux of the transition), in one pass over the levels below start_id
+        if not 0 <= start_id < self.n_states:
+            raise ValueError('unknown state ID %d' % start_id)
+        passing = np.zeros(self.n_states)
+        flux = np.zeros(len(self.rate))
+        passing[start_id] = 1
+        for state_id in self.order[self.position[start_id]:]:
+            if passing[state_id] == 0:
+                continue
+            rows = self.dataset.get_spontaneous_rows_from(state_id)
+            flux[rows] = passing[state_id] * self.branching[rows]
+            np.add.at(passing, self.lower[rows], flux[rows])
+        return passing, flux
+
+    def branching_matrix(self):
+        # cumulative branching fractions of all levels: matrix[s, t] is the fraction of the population
+        # of level s passing through level t, from the lowest to the highest level in one pass
+        matrix = np.eye(self.n_states)
+        for state_id in self.order[::-1]:
+            rows = self.dataset.get_spontaneous_rows_from(state_id)
+            if len(rows):
+                matrix[state_id] += self.branching[rows] @ matrix[self.lower[rows]]
+        return matrix
+
+    def detected_photons(self, detected):
+        # expected number of photons on the detected spontaneous rows (a mask, or weights per row) in
+        # the cascade of every starting level, from the lowest to the highest level in one pass
+        weights = np.asarray(detected, dtype=float)
+        photons = np.zeros(self.n_states)
+        for state_id in self.order[::-1]:
+            rows = self.dataset.get_spontaneous_rows_from(state_id)
+            if len(rows):
+                photons[state_id] = self.branching[rows] @ (weights[rows] + photons[self.lower[rows]])
+        return photons
+
+    def terminal_fractions(self, start_id):
+        # fraction of the population of start_id ending in every terminal level
+        passing, _ = self.populations(start_id)
+        return np.where(self.total_rate == 0, passing, 0)
+
+    def evolve(self, start_id, times):
+        # populations versus time (s) after putting all the population in start_id at t = 0, from the
+        # rate equations dN/dt = A N restricted to the levels reachable from start_id;
+        # returns the state IDs of these levels and the populations, of shape (len(times), len(ids))
+        passing, flux = self.populations(start_id)
+        ids = np.nonzero(passing)[0]
+        position = -np.ones(self.n_states, dtype=np.int64)
+        position[ids] = np.arange(len(ids))
+        rows = np.nonzero(flux)[0]
+        # sparse rate matrix: a level decays to a few lower levels only
+        lower, upper = position[self.lower[rows]], position[self.upper[rows]]
+        diagonal = np.arange(len(ids))
+        a = csr_matrix((np.concatenate([self.rate[rows], -self.total_rate[ids]]),
+                        (np.concatenate([lower, diagonal]), np.concatenate([upper, diagonal]))),
+                       shape=(len(ids), len(ids)))
+
+        times = np.asarray(times, dtype=float)
+        n0 = np.zeros(len(ids))
+        n0[position[start_id]] = 1
+        if len(times) > 1 and np.allclose(np.diff(times), times[1] - times[0]):
+            # uniform time grid: the action of exp(A t) on N0 at all times in one call
+            populations = expm_multiply(a, n0, start=times[0], stop=times[-1], num=len(times), endpoint=True)
+        else:
+            populations = np.zeros((len(times), len(ids)))
+            for i, t in enumerate(times):
+                populations[i] = expm_multiply(a * t, n0)
+        return ids, populations
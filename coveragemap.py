@@ -0,0 +1,108 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from dataset import Dataset, get_paths
+
+# THz coverage map of the absorption lines.
+#
+# The frequency axis from freq_min to freq_max is split in bins of fixed width (1 GHz by default); for
+# every bin the map gives the number of absorption lines, the strongest |dipole| and the line that has
+# it. Lines are taken in frequency order (the index of the Dataset), so that the bins are contiguous
+# runs of lines: counts come from np.bincount and maxima from np.maximum.reduceat, without a mask per
+# window. The map is saved next to the data ("coverage.npy") and rebuilt when the data or the binning
+# changes; path-select.py uses it to list the most promising windows.
+#
+#### Data format of file "coverage.npy" ####
+# freq_lower | freq_upper (THz)         - bin edges, lines with freq_lower <= freq < freq_upper
+# count                                 - number of absorption lines in the bin
+# max_dipole (a0*e)                     - largest |dipole| of the bin, 0 for an empty bin
+# row                                   - row of "absorption.ids.npy" with max_dipole, -1 for an empty bin
+# lower | upper | two_mj_lower | two_mj_upper - states of this row
+
+COVERAGE_DTYPE = np.dtype([('freq_lower', 'f8'), ('freq_upper', 'f8'), ('count', 'i8'), ('max_dipole', 'f8'),
+                           ('row', 'i8'), ('lower', 'i4'), ('upper', 'i4'),
+                           ('two_mj_lower', 'i1'), ('two_mj_upper', 'i1')])
+
+def get_n_bins(freq_min, freq_max, resolution):
+    return int(round((freq_max - freq_min) / resolution))
+
+def compute_coverage(dataset, freq_min=0.1, freq_max=3.0, resolution=1e-3):
+    n_bins = get_n_bins(freq_min, freq_max, resolution)
+    absp = dataset.absp
+    if hasattr(dataset, 'absp_by_freq'):
+        order, freq_sorted = dataset.absp_by_freq, dataset.absp_freq_sorted
+    else:
+        order = np.argsort(absp['freq'], kind='stable')
+        freq_sorted = absp['freq'][order]
+    i0 = np.searchsorted(freq_sorted, freq_min, side='left')
+    i1 = np.searchsorted(freq_sorted, freq_min + n_bins * resolution, side='left')
+    rows, freq = order[i0:i1], np.asarray(freq_sorted[i0:i1])
+    bins = np.minimum(((freq - freq_min) / resolution).astype(np.int64), n_bins - 1)
+    dipole = np.abs(absp['dipole'][rows])
+
+    coverage = np.zeros(n_bins, dtype=COVERAGE_DTYPE)
+    coverage['freq_lower'] = freq_min + np.arange(n_bins) * resolution
+    coverage['freq_upper'] = coverage['freq_lower'] + resolution
+    coverage['count'] = np.bincount(bins, minlength=n_bins)
+    coverage['row'] = coverage['lower'] = coverage['upper'] = -1
+    if len(rows) == 0:
+        return coverage
+    # bins do not decrease along the lines: every occupied bin is one run of lines
+    starts = np.flatnonzero(np.r_[True, np.diff(bins) > 0])
+    occupied = bins[starts]
+    coverage['max_dipole'][occupied] = np.maximum.reduceat(dipole, starts)
+    # the first line of every run with the maximum of the run
+    is_max = np.flatnonzero(dipole == coverage['max_dipole'][bins])
+    best = is_max[np.r_[True, np.diff(bins[is_max]) > 0]]
+    best_rows = rows[best]
+    lines = absp[best_rows]
+    coverage['row'][occupied] = best_rows
+    for name in ['lower', 'upper', 'two_mj_lower', 'two_mj_upper']:
+        coverage[name][occupied] = lines[name]
+    return coverage
+
+def load_coverage(dataset, freq_min=0.1, freq_max=3.0, resolution=1e-3):
+    # coverage map of "coverage.npy", (re)computed if it is missing, older than the data or of another binning
+    path = os.path.join(dataset.directory, 'coverage.npy')
+    absp_path = get_paths(dataset.directory)['absorption.ids']
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(absp_path):
+        coverage = np.load(path)
+        if len(coverage) == get_n_bins(freq_min, freq_max, resolution) and len(coverage) > 0 and \
+                np.isclose(coverage['freq_lower'][0], freq_min) and \
+                np.isclose(coverage['freq_upper'][0] - coverage['freq_lower'][0], resolution):
+            return coverage
+    coverage = compute_coverage(dataset, freq_min, freq_max, resolution)
+    np.save(path + '.tmp.npy', coverage)
+    os.replace(path + '.tmp.npy', path)
+    return coverage
+
+def get_best_windows(coverage, k=None, min_count=1):
+    # bins with at least min_count lines, by decreasing max_dipole
+    bins = np.flatnonzero(coverage['count'] >= min_count)
+    bins = bins[np.argsort(-coverage['max_dipole'][bins], kind='stable')]
+    return coverage[bins[:k]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='THz coverage map of absorption.dat.')
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--min', type=float, default=0.1, help='lowest frequency (THz)')
+    parser.add_argument('--max', type=float, default=3.0, help='highest frequency (THz)')
+    parser.add_argument('--resolution', type=float, default=1e-3, help='bin width (THz)')
+    parser.add_argument('--top', type=int, default=20, help='number of windows to print')
+    args = parser.parse_args(argv)
+
+    dataset = Dataset(args.directory)
+    coverage = load_coverage(dataset, args.min, args.max, args.resolution)
+    print('%d of %d bins with lines, %d lines' % ((coverage['count'] > 0).sum(), len(coverage), coverage['count'].sum()))
+    print('window (THz)          lines  max |dipole|  line')
+    for window in get_best_windows(coverage, args.top):
+        print('%.4f - %.4f  %6d  %12.4g  %s (mj %g) -> %s (mj %g)' % \
+            (window['freq_lower'], window['freq_upper'], window['count'], window['max_dipole'],
+             dataset.get_label(window['lower']), window['two_mj_lower']/2,
+             dataset.get_label(window['upper']), window['two_mj_upper']/2))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+# Binary format of the data files.
+#
+# Every text file (e.g. "absorption.dat") has a binary twin with the same name and the extension
+# ".npy", holding a numpy structured array with one typed field per column. Loaders open the binary
+# file with np.load(mmap_mode='r'), so that startup does not parse text and the pages are shared
+# between all processes (GUI, plotting) reading the same file.
+
+#### Data format of file "absorption.dat" ####
+# idx 0: n1 | idx 1: l1 | idx 2: j1 | idx 3: mj1
+# idx 4: n2 | idx 5: l2 | idx 6: j2 | idx 7: mj2
+# idx 8: frequency (THz)
+# idx 9: wavelength (nm)
+# idx 10: dipole moment (a0*e)
+ABSP_DTYPE = np.dtype([('n1', 'i2'), ('l1', 'i1'), ('j1', 'f4'), ('mj1', 'f4'),
+                       ('n2', 'i2'), ('l2', 'i1'), ('j2', 'f4'), ('mj2', 'f4'),
+                       ('freq', 'f8'), ('wavelength', 'f8'), ('dipole', 'f8')])
+
+#### Data format of file "spontaneous.dat" ####
+# idx 0: n_upper | idx 1: l_upper | idx 2: j_upper
+# idx 3: n_lower | idx 4: l_lower | idx 5: j_lower
+# idx 6: frequency (THz)
+# idx 7: wavelength (nm)
+# idx 8: transition rate (s^-1)
+SPON_DTYPE = np.dtype([('n_upper', 'i2'), ('l_upper', 'i1'), ('j_upper', 'f4'),
+                       ('n_lower', 'i2'), ('l_lower', 'i1'), ('j_lower', 'f4'),
+                       ('freq', 'f8'), ('wavelength', 'f8'), ('rate', 'f8')])
+
+#### Data format of file "levels.dat" ####
+# idx 0: n | idx 1: l | idx 2: j
+# idx 3: energy (eV)
+# idx 4: lifetime (ns)
+LEVL_DTYPE = np.dtype([('n', 'i2'), ('l', 'i1'), ('j', 'f4'),
+                       ('energy', 'f8'), ('lifetime', 'f8')])
+
+def get_sweep_dtype(n_temperatures):
+    # "spontaneous_sweep.npz": the columns of "spontaneous.dat" with one rate per temperature
+    return np.dtype([('n_upper', 'i2'), ('l_upper', 'i1'), ('j_upper', 'f4'),
+                     ('n_lower', 'i2'), ('l_lower', 'i1'), ('j_lower', 'f4'),
+                     ('freq', 'f8'), ('wavelength', 'f8'), ('rate', 'f8', (n_temperatures,))])
+
+DTYPES = {'absorption': ABSP_DTYPE, 'spontaneous': SPON_DTYPE, 'levels': LEVL_DTYPE}
+
+CHUNK_ROWS = 1000000
+
+def get_kind(path):
+    # kind of data file, from its name or else from the number of columns of its first line
+    name = os.path.basename(path)
+    for kind in DTYPES:
+        if name.startswith(kind):
+            return kind
+    with open(path) as f:
+        n_col = len(f.readline().split())
+    for kind, dtype in DTYPES.items():
+        if len(dtype.names) == n_col:
+            return kind
+    raise ValueError('unknown data file: ' + path)
+
+def get_binary_path(path):
+    return os.path.splitext(path)[0] + '.npy'
+
+def count_lines(path):
+    n, last = 0, b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n += block.count(b'\n')
+            last = block[-1:]
+    # the last line may not end with a newline
+    return n if last == b'\n' else n + 1
+
+def convert(path, output=None, kind=None):
+    # convert a text data file to its binary twin, chunk by chunk, so that memory stays bounded
+    if output is None:
+        output = get_binary_path(path)
+    if kind is None:
+        kind = get_kind(path)
+    dtype = DTYPES[kind]
+    n_row = count_lines(path)
+    data = np.lib.format.open_memmap(output + '.tmp', mode='w+', dtype=dtype, shape=(n_row,))
+    i = 0
+    with open(path) as f:
+        while True:
+            lines = [line for _, line in zip(range(CHUNK_ROWS), f)]
+            if not lines:
+                break
+            chunk = np.loadtxt(lines, ndmin=2)
+            for k, name in enumerate(dtype.names):
+                data[name][i:i+len(chunk)] = chunk[:, k]
+            i += len(chunk)
+    data.flush()
+    del data
+    os.replace(output + '.tmp', output)
+    return output
+
+def load_data(path):
+    # open the binary twin of a data file memory-mapped, (re)converting it if it is missing or stale
+    binary = get_binary_path(path)
+    if not os.path.exists(binary) or \
+            (os.path.exists(path) and os.path.getmtime(binary) < os.path.getmtime(path)):
+        convert(path, binary)
+    return np.load(binary, mmap_mode='r')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert data files (*.dat) to the binary format (*.npy).')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+    for path in args.files:
+        print(path, '->', convert(path))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
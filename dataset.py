@@ -0,0 +1,269 @@
+import os
+
+import numpy as np
+
+from datafile import load_data, get_binary_path, CHUNK_ROWS
+
+# Normalized dataset with integer state IDs.
+#
+# Every (n, l, j) state gets a compact integer ID, its row in the state table "states.npy" (sorted by
+# n, l, j). Transitions refer to states by ID, so that energies, lifetimes and labels are looked up by
+# indexing the state table instead of scanning it, and quantum numbers take a few bytes per row.
+# Absorption rows are ordered lower -> upper level (E_lower < E_upper) as in path-select.py, i.e.
+# rows with freq < 0 are swapped and their frequency, wavelength and dipole change sign.
+#
+#### Data format of file "states.npy" ####
+# n | l | j | energy (eV) | lifetime (ns)      - NaN for states that are not in "levels.dat"
+#
+#### Data format of file "absorption.ids.npy" ####
+# lower | upper                                - state IDs
+# two_mj_lower | two_mj_upper                  - 2*mj
+# freq (THz) | wavelength (nm) | dipole (a0*e)
+#
+#### Data format of file "spontaneous.ids.npy" ####
+# upper | lower                                - state IDs
+# freq (THz) | wavelength (nm) | rate (s^-1)
+#
+# With a temperature sweep ("spontaneous_sweep.npz", see generate.py), set_temperature() replaces the
+# spontaneous rows by the rows of the sweep at one of its temperatures, in memory.
+
+l_notion = ['s', 'p', 'd', 'f', 'g', 'h', 'i', 'k']
+
+STATE_DTYPE = np.dtype([('n', 'i2'), ('l', 'i1'), ('j', 'f4'),
+                        ('energy', 'f8'), ('lifetime', 'f8')])
+
+def get_id_type(n_states):
+    return np.dtype('i2') if n_states < np.iinfo('i2').max else np.dtype('i4')
+
+def get_absp_ids_dtype(id_type):
+    return np.dtype([('lower', id_type), ('upper', id_type), ('two_mj_lower', 'i1'), ('two_mj_upper', 'i1'),
+                     ('freq', 'f8'), ('wavelength', 'f8'), ('dipole', 'f8')])
+
+def get_spon_ids_dtype(id_type):
+    return np.dtype([('upper', id_type), ('lower', id_type),
+                     ('freq', 'f8'), ('wavelength', 'f8'), ('rate', 'f8')])
+
+def get_j_index(l, j):
+    # 0 for j = l-1/2, 1 for j = l+1/2 (and for the s states)
+    return np.rint(np.asarray(j) - np.asarray(l) + 0.5).astype(int)
+
+def build_state_index(states):
+    # dense table [n, l, j index] -> state ID, -1 for unknown states
+    index = -np.ones((int(states['n'].max())+1, int(states['l'].max())+1, 2), dtype=int)
+    index[states['n'], states['l'], get_j_index(states['l'], states['j'])] = np.arange(len(states))
+    return index
+
+def lookup_state_ids(index, n, l, j):
+    n, l = np.asarray(n).astype(int), np.asarray(l).astype(int)
+    return index[n, l, get_j_index(l, j)]
+
+def get_transition_states(data, prefixes):
+    # unique (n, l, j) of the states of the transitions, chunk by chunk
+    keys = set()
+    for i in range(0, len(data), CHUNK_ROWS):
+        chunk = data[i:i+CHUNK_ROWS]
+        for p in prefixes:
+            keys.update(zip(chunk['n'+p].tolist(), chunk['l'+p].tolist(), chunk['j'+p].tolist()))
+    return keys
+
+def build_states(levl, absp, spon):
+    keys = set(zip(levl['n'].tolist(), levl['l'].tolist(), levl['j'].tolist()))
+    keys |= get_transition_states(absp, ['1', '2'])
+    keys |= get_transition_states(spon, ['_upper', '_lower'])
+    states = np.zeros(len(keys), dtype=STATE_DTYPE)
+    states['n'], states['l'], states['j'] = np.array(sorted(keys)).T
+    states['energy'] = states['lifetime'] = np.nan
+    index = build_state_index(states)
+    ids = lookup_state_ids(index, levl['n'], levl['l'], levl['j'])
+    states['energy'][ids] = levl['energy']
+    states['lifetime'][ids] = levl['lifetime']
+    return states, index
+
+def normalize_absorption(absp, index, output, id_type):
+    data = np.lib.format.open_memmap(output + '.tmp', mode='w+', dtype=get_absp_ids_dtype(id_type), shape=(len(absp),))
+    for i in range(0, len(absp), CHUNK_ROWS):
+        chunk = absp[i:i+CHUNK_ROWS]
+        out = data[i:i+CHUNK_ROWS]
+        id1 = lookup_state_ids(index, chunk['n1'], chunk['l1'], chunk['j1'])
+        id2 = lookup_state_ids(index, chunk['n2'], chunk['l2'], chunk['j2'])
+        swap = chunk['freq'] < 0
+        sign = np.where(swap, -1, 1)
+        out['lower'] = np.where(swap, id2, id1)
+        out['upper'] = np.where(swap, id1, id2)
+        out['two_mj_lower'] = np.rint(2*np.where(swap, chunk['mj2'], chunk['mj1']))
+        out['two_mj_upper'] = np.rint(2*np.where(swap, chunk['mj1'], chunk['mj2']))
+        out['freq'] = sign * chunk['freq']
+        out['wavelength'] = sign * chunk['wavelength']
+        out['dipole'] = sign * chunk['dipole']
+    data.flush()
+    del data
+    os.replace(output + '.tmp', output)
+
+def normalize_spontaneous(spon, index, output, id_type):
+    data = np.lib.format.open_memmap(output + '.tmp', mode='w+', dtype=get_spon_ids_dtype(id_type), shape=(len(spon),))
+    for i in range(0, len(spon), CHUNK_ROWS):
+        chunk = spon[i:i+CHUNK_ROWS]
+        out = data[i:i+CHUNK_ROWS]
+        out['upper'] = lookup_state_ids(index, chunk['n_upper'], chunk['l_upper'], chunk['j_upper'])
+        out['lower'] = lookup_state_ids(index, chunk['n_lower'], chunk['l_lower'], chunk['j_lower'])
+        for name in ['freq', 'wavelength', 'rate']:
+            out[name] = chunk[name]
+    data.flush()
+    del data
+    os.replace(output + '.tmp', output)
+
+def get_paths(directory):
+    return {'levels': os.path.join(directory, 'levels.dat'),
+            'absorption': os.path.join(directory, 'absorption.dat'),
+            'spontaneous': os.path.join(directory, 'spontaneous.dat'),
+            'states': os.path.join(directory, 'states.npy'),
+            'absorption.ids': os.path.join(directory, 'absorption.ids.npy'),
+            'spontaneous.ids': os.path.join(directory, 'spontaneous.ids.npy'),
+            'sweep': os.path.join(directory, 'spontaneous_sweep.npz')}
+
+def get_mtime(path):
+    # modification time of a data file or of its binary twin, whichever is newer
+    return max([os.path.getmtime(p) for p in [path, get_binary_path(path)] if os.path.exists(p)], default=0)
+
+def normalize(directory='.'):
+    # (re)build the normalized files if they are missing or older than the data files
+    paths = get_paths(directory)
+    normalized = [paths['states'], paths['absorption.ids'], paths['spontaneous.ids']]
+    mtime = max(get_mtime(paths[name]) for name in ['levels', 'absorption', 'spontaneous'])
+    if all(os.path.exists(p) and os.path.getmtime(p) >= mtime for p in normalized):
+        return
+    levl = load_data(paths['levels'])
+    absp = load_data(paths['absorption'])
+    spon = load_data(paths['spontaneous'])
+    states, index = build_states(levl, absp, spon)
+    id_type = get_id_type(len(states))
+    normalize_absorption(absp, index, paths['absorption.ids'], id_type)
+    normalize_spontaneous(spon, index, paths['spontaneous.ids'], id_type)
+    # the state table is written last, it marks the normalized files as complete
+    np.save(paths['states'] + '.tmp.npy', states)
+    os.replace(paths['states'] + '.tmp.npy', paths['states'])
+
+def group_rows(keys, n_keys):
+    # CSR-style grouping: rows order[offsets[k]:offsets[k+1]] have key k, in their original order
+    order = np.argsort(keys, kind='stable')
+    offsets = np.zeros(n_keys+1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return order, offsets
+
+class Dataset():
+    # normalized levels, absorption and spontaneous data of one directory, memory-mapped
+
+    def __init__(self, directory='.', indexes=True, load=True):
+        # load=False only records the directory, so that loading can run later (e.g. in a thread)
+        self.directory = directory
+        if load:
+            self.load()
+            if indexes:
+                self.build_indexes()
+
+    def load(self):
+        normalize(self.directory)
+        paths = get_paths(self.directory)
+        self.states = np.load(paths['states'], mmap_mode='r')
+        self.absp = np.load(paths['absorption.ids'], mmap_mode='r')
+        self.spon = np.load(paths['spontaneous.ids'], mmap_mode='r')
+        self.index = build_state_index(self.states)
+        self.spon_file = self.spon
+        self.temperature = None
+
+    def load_sweep(self):
+        # temperatures and rates of the sweep, if any; self.temperatures is None without a sweep
+        self.temperatures = None
+        path = get_paths(self.directory)['sweep']
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            temperatures, sweep = data['temperatures'], data['transitions']
+        upper = self.get_state_ids_or_missing(sweep['n_upper'], sweep['l_upper'], sweep['j_upper'])
+        lower = self.get_state_ids_or_missing(sweep['n_lower'], sweep['l_lower'], sweep['j_lower'])
+        known = (upper >= 0) & (lower >= 0)
+        self.sweep = np.zeros(known.sum(), dtype=get_spon_ids_dtype(self.spon_file.dtype['upper']))
+        self.sweep['upper'], self.sweep['lower'] = upper[known], lower[known]
+        self.sweep['freq'], self.sweep['wavelength'] = sweep['freq'][known], sweep['wavelength'][known]
+        self.sweep_rates = sweep['rate'][known]
+        self.temperatures = temperatures
+
+    def set_temperature(self, temperature=None):
+        # spontaneous rows of the sweep at one of its temperatures, or of "spontaneous.dat" for None;
+        # the spontaneous index is rebuilt if it was built
+        if temperature is None:
+            self.spon = self.spon_file
+        else:
+            k = int(np.argmin(np.abs(self.temperatures - temperature)))
+            rows = np.flatnonzero(self.sweep_rates[:, k] > 0)
+            self.spon = self.sweep[rows]
+            self.spon['rate'] = self.sweep_rates[rows, k]
+            temperature = float(self.temperatures[k])
+        self.temperature = temperature
+        if hasattr(self, 'spon_by_upper'):
+            self.build_spontaneous_indexes()
+
+    def build_indexes(self):
+        self.build_absorption_indexes()
+        self.build_spontaneous_indexes()
+
+    def build_absorption_indexes(self):
+        # absorption rows grouped by upper (n, l, j, mj), and sorted by frequency
+        n_states = len(self.states)
+        self.max_two_mj = int(np.abs(self.absp['two_mj_upper']).max()) if len(self.absp) else 0
+        self.absp_by_upper = group_rows(self.get_absp_upper_keys(self.absp['upper'], self.absp['two_mj_upper']),
+                                        n_states * (2*self.max_two_mj+1))
+        self.absp_by_freq = np.argsort(self.absp['freq'], kind='stable')
+        self.absp_freq_sorted = self.absp['freq'][self.absp_by_freq]
+
+    def build_spontaneous_indexes(self):
+        # spontaneous rows grouped by upper (n, l, j)
+        self.spon_by_upper = group_rows(self.spon['upper'].astype(np.int64), len(self.states))
+
+    def get_absp_upper_keys(self, upper, two_mj_upper):
+        return np.asarray(upper, dtype=np.int64) * (2*self.max_two_mj+1) + (np.asarray(two_mj_upper) + self.max_two_mj)
+
+    def get_state_id(self, n, l, j):
+        # ValueError for a state that is not in the state table
+        state_id = -1
+        if 0 <= n < self.index.shape[0] and 0 <= l < self.index.shape[1] and int(get_j_index(l, j)) in [0, 1]:
+            state_id = int(lookup_state_ids(self.index, n, l, j))
+        if state_id < 0:
+            raise ValueError('unknown state (n, l, j) = (%g, %g, %g)' % (n, l, j))
+        return state_id
+
+    def get_state_ids(self, n, l, j):
+        return lookup_state_ids(self.index, n, l, j)
+
+    def get_state_ids_or_missing(self, n, l, j):
+        # like get_state_ids, with -1 for the states out of the state table
+        n, l = np.asarray(n).astype(int), np.asarray(l).astype(int)
+        inside = (n < self.index.shape[0]) & (l < self.index.shape[1])
+        ids = -np.ones(len(n), dtype=int)
+        ids[inside] = lookup_state_ids(self.index, n[inside], l[inside], np.asarray(j)[inside])
+        return ids
+
+    def get_label(self, state_id):
+        state = self.states[state_id]
+        return "%d%s%3.1f" % (state['n'], l_notion[int(state['l'])], state['j'])
+
+    def get_absorption_rows_to(self, state_id, two_mj):
+        # rows of absorption to the upper level (state_id, mj), O(1) with the CSR index
+        if state_id < 0 or abs(two_mj) > self.max_two_mj:
+            return np.zeros(0, dtype=np.int64)
+        order, offsets = self.absp_by_upper
+        key = int(self.get_absp_upper_keys(state_id, two_mj))
+        return order[offsets[key]:offsets[key+1]]
+
+    def get_spontaneous_rows_from(self, state_id):
+        # rows of spontaneous radiation from the upper level state_id
+        if state_id < 0:
+            return np.zeros(0, dtype=np.int64)
+        order, offsets = self.spon_by_upper
+        return order[offsets[state_id]:offsets[state_id+1]]
+
+    def get_absorption_rows_in_window(self, freq_lower, freq_upper):
+        # rows of absorption with freq_lower < freq < freq_upper, in file order, by binary search
+        i0 = np.searchsorted(self.absp_freq_sorted, freq_lower, side='right')
+        i1 = np.searchsorted(self.absp_freq_sorted, freq_upper, side='left')
+        return np.sort(self.absp_by_freq[i0:max(i0, i1)])
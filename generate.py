@@ -0,0 +1,623 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import threading
+import argparse
+import importlib
+import multiprocessing
+
+import numpy as np
+from scipy.constants import pi, hbar, k as C_k
+
+import instrument
+from cache import CachedAtom, CACHED_METHODS
+from blockstore import BlockStore, get_params_hash
+from datafile import convert, get_sweep_dtype
+
+#### Data format of file "absorption.dat" ####
+# idx 0: n1 | idx 1: l1 | idx 2: j1 | idx 3: mj1
+# idx 4: n2 | idx 5: l2 | idx 6: j2 | idx 7: mj2
+# idx 8: frequency (THz)
+# idx 9: wavelength (nm)
+# idx 10: dipole moment (a0*e)
+ABSP_FORMAT = "%3d %3d %5.1f %5.1f %3d %3d %5.1f %5.1f  %le  %le  %le\n"
+
+#### Data format of file "spontaneous.dat" ####
+# idx 0: n_upper | idx 1: l_upper | idx 2: j_upper
+# idx 3: n_lower | idx 4: l_lower | idx 5: j_lower
+# idx 6: frequency (THz)
+# idx 7: wavelength (nm)
+# idx 8: transition rate (s^-1)
+SPON_FORMAT = "%3d %3d %5.1f %3d %3d %5.1f  %le  %le  %le\n"
+
+#### Data format of file "spontaneous_sweep.dat" ####
+# idx 0: n_upper | idx 1: l_upper | idx 2: j_upper
+# idx 3: n_lower | idx 4: l_lower | idx 5: j_lower
+# idx 6: frequency (Hz)
+# idx 7: wavelength (nm)
+# idx 8: transition rate at 0 K (s^-1)
+# the temperature-independent part of the rates, at full precision: the rates at any temperature
+# follow from columns 6 and 8 (see get_blackbody_rates) without calling ARC again
+SWEEP_FORMAT = "%3d %3d %5.1f %3d %3d %5.1f  %.17e  %.17e  %.17e\n"
+
+#### Data format of file "levels.dat" ####
+# idx 0: n | idx 1: l | idx 2: j
+# idx 3: energy (eV)
+# idx 4: lifetime (ns)
+LEVL_FORMAT = "%3d %3d %5.1f  %le  %le\n"
+
+DIPOLE_CUTOFF = 1e-5
+RATE_CUTOFF = 1e-5
+
+def get_atom(name):
+    # atoms are created by name so that worker processes can build their own instance; a dotted name
+    # "module.Class" is a stand-in with the same methods, e.g. benchmark.SyntheticAtom (no ARC needed).
+    # ValueError for an unknown name
+    if '.' in name:
+        module, class_name = name.rsplit('.', 1)
+        try:
+            atom_class = getattr(importlib.import_module(module), class_name)
+        except (ImportError, AttributeError) as e:
+            raise ValueError('unknown atom %s: %s' % (name, e))
+    else:
+        try:
+            import arc
+        except ImportError as e:
+            raise ValueError('atom %s needs ARC: %s' % (name, e))
+        atom_class = getattr(arc, name, None)
+        if not isinstance(atom_class, type):
+            raise ValueError('unknown atom: ' + name)
+    return atom_class()
+
+def get_j_list(l):
+    if l > 0:
+        return [l-0.5, l+0.5]
+    return [0.5]
+
+def check_selection_rule(l1, l2, j1, j2):
+    return check_selection_rule_wigner_6j(j1, 1, j2, l2, 0.5, l1)
+
+def check_selection_rule_wigner_6j(j1, j2, j3, J1, J2, J3):
+    if ((abs(j1 - j2) > j3)
+        | (j1 + j2 < j3)
+        | (abs(j1 - J2) > J3)
+        | (j1 + J2 < J3)
+        | (abs(J1 - j2) > J3)
+        | (J1 + j2 < J3)
+        | (abs(J1 - J2) > j3)
+        | (J1 + J2 < j3)
+            ):
+        return -1
+
+    # Check if the sum of the elements of each traid is an integer
+    if ((2 * (j1 + j2 + j3) != round(2 * (j1 + j2 + j3)))
+        | (2 * (j1 + J2 + J3) != round(2 * (j1 + J2 + J3)))
+        | (2 * (J1 + j2 + J3) != round(2 * (J1 + j2 + J3)))
+        | (2 * (J1 + J2 + j3) != round(2 * (J1 + J2 + j3)))
+            ):
+        return -1
+    return 1
+
+def get_wigner_6j_mask(j1, j2, j3, J1, J2, J3):
+    # check_selection_rule_wigner_6j on numpy arrays: True where the rules hold
+    mask = True
+    for a, b, c in [(j1, j2, j3), (j1, J2, J3), (J1, j2, J3), (J1, J2, j3)]:
+        mask = mask & (np.abs(a - b) <= c) & (a + b >= c) & (2 * (a + b + c) == np.round(2 * (a + b + c)))
+    return mask
+
+def get_dipole_moment(atom, n1, l1, j1, mj1, n2, l2, j2, mj2, q):
+    if q == 0 and j1 == 0 and j2 == 0:
+        return 0
+    if mj2 - mj1 != q:
+        return 0
+    if check_selection_rule(l1, l2, j1, j2) < 0:
+        return 0
+    return atom.getDipoleMatrixElement(n1, l1, j1, mj1, n2, l2, j2, mj2, q)
+
+def get_spherical_factors(j1, mj1, j2, q):
+    # angular factor (-1)**(j1-mj1) * Wigner3j(j1, 1, j2, -mj1, -q, mj2) of ARC's getDipoleMatrixElement,
+    # evaluated for a numpy array mj1 with mj2 = mj1 + q, from the closed-form Clebsch-Gordan
+    # coefficients <j1 m1; 1 m2 | j2 m> of a rank-1 coupling
+    if q not in (-1, 0, 1):
+        raise ValueError('invalid polarization q=%s, expected -1, 0 or 1' % q)
+    mj1 = np.asarray(mj1, dtype=float)
+    mj2 = mj1 + q
+    m, m2 = -mj2, -q
+    if abs(j2 - (j1+1)) < 1e-9:
+        denom = (2*j1+1) * (2*j1+2)
+        if m2 == 1:
+            cg = np.sqrt((j1+m)*(j1+m+1) / denom)
+        elif m2 == 0:
+            cg = np.sqrt((j1-m+1)*(j1+m+1) / ((2*j1+1)*(j1+1)))
+        else:
+            cg = np.sqrt((j1-m)*(j1-m+1) / denom)
+    elif abs(j2 - j1) < 1e-9:
+        denom = 2*j1*(j1+1)
+        if m2 == 1:
+            cg = -np.sqrt((j1+m)*(j1-m+1) / denom)
+        elif m2 == 0:
+            cg = m / np.sqrt(j1*(j1+1))
+        else:
+            cg = np.sqrt((j1-m)*(j1+m+1) / denom)
+    elif abs(j2 - (j1-1)) < 1e-9:
+        denom = 2*j1*(2*j1+1)
+        if m2 == 1:
+            cg = np.sqrt((j1-m)*(j1-m+1) / denom)
+        elif m2 == 0:
+            cg = -np.sqrt((j1-m)*(j1+m) / (j1*(2*j1+1)))
+        else:
+            cg = np.sqrt((j1+m+1)*(j1+m) / denom)
+    else:
+        return np.zeros_like(mj1)
+    # 3j = (-1)**(j1-1-mj2) * cg / sqrt(2*j2+1), times the (-1)**(j1-mj1) of the spherical component
+    sign = 1 - 2 * (np.rint(2*j1 - mj1 - mj2 - 1).astype(int) % 2)
+    return sign * cg / np.sqrt(2*j2+1)
+
+def pair_rows_mj(atom, n1, l1, j1, n2, l2, j2, q, frequency):
+    # one ARC dipole matrix element per (mj1, mj2), as in the notebook
+    rows = []
+    for mj1 in np.arange(-j1, j1+1, 1):
+        for mj2 in np.arange(-j2, j2+1, 1):
+            if frequency > 0:
+                dipole = get_dipole_moment(atom, n1, l1, j1, mj1, n2, l2, j2, mj2, q)
+            else:
+                dipole = get_dipole_moment(atom, n2, l2, j2, mj2, n1, l1, j1, mj1, -q)
+            if np.abs(dipole) > DIPOLE_CUTOFF:
+                rows.append((mj1, mj2, dipole))
+    return rows
+
+def pair_rows_reduced(atom, n1, l1, j1, n2, l2, j2, q, frequency):
+    # one ARC reduced matrix element per (n1, l1, j1, n2, l2, j2), all mj components from the angular factors
+    if frequency > 0:
+        na, la, ja, nb, lb, jb, qa = n1, l1, j1, n2, l2, j2, q
+    else:
+        na, la, ja, nb, lb, jb, qa = n2, l2, j2, n1, l1, j1, -q
+    if qa == 0 and ja == 0 and jb == 0:
+        return []
+    if check_selection_rule(la, lb, ja, jb) < 0:
+        return []
+    mj1 = np.arange(-j1, j1+1, 1)
+    mj2 = mj1 + q
+    mj1, mj2 = mj1[np.abs(mj2) <= j2 + 1e-9], mj2[np.abs(mj2) <= j2 + 1e-9]
+    if mj1.size == 0:
+        return []
+    reduced = atom.getReducedMatrixElementJ(na, la, ja, nb, lb, jb)
+    if frequency > 0:
+        dipole = get_spherical_factors(j1, mj1, j2, q) * reduced
+    else:
+        dipole = get_spherical_factors(j2, mj2, j1, -q) * reduced
+    idx = np.abs(dipole) > DIPOLE_CUTOFF
+    return list(zip(mj1[idx], mj2[idx], dipole[idx]))
+
+PAIR_ROWS = {'mj': pair_rows_mj, 'reduced': pair_rows_reduced}
+
+def absorption_block(atom, n1, l1, n2, l2, q, method='mj', pairs=None):
+    # lines of "absorption.dat" of the block (n1, l1, n2, l2), in the order of the serial loops;
+    # pairs: the (j1, j2) to compute, e.g. from get_candidate_pairs, by default all of them
+    pair_rows = PAIR_ROWS[method]
+    lines = []
+    if n1 == n2 and l1 == l2:
+        return lines
+    if pairs is None:
+        pairs = [(j1, j2) for j1 in get_j_list(l1) for j2 in get_j_list(l2)]
+    for j1, j2 in pairs:
+        frequency = atom.getTransitionFrequency(n1, l1, j1, n2, l2, j2) / 1e12
+        rows = pair_rows(atom, n1, l1, j1, n2, l2, j2, q, frequency)
+        if not rows:
+            continue
+        wavelength = atom.getTransitionWavelength(n1, l1, j1, n2, l2, j2)/1e-9
+        for mj1, mj2, dipole in rows:
+            lines.append(ABSP_FORMAT % \
+                (n1, l1, j1, mj1, n2, l2, j2, mj2, \
+                 frequency, wavelength, dipole))
+    return lines
+
+def levels_block(atom, n, l):
+    # lines of "levels.dat" of the block (n, l)
+    lines = []
+    for j in get_j_list(l):
+        energy = atom.getEnergy(n, l, j)
+        lifetime = atom.getStateLifetime(n, l, j)/1e-9
+        lines.append(LEVL_FORMAT % (n, l, j, energy, lifetime))
+    return lines
+
+def check_spontaneous_transition_rule(l1, l2, j1, j2):
+    return check_selection_rule_wigner_6j(l1, l2, 1, j2, j1, 0.5)
+
+def spontaneous_block(atom, n1, n2, l1, l2, temperature=300, pairs=None):
+    # lines of "spontaneous.dat" of the block (n1, n2, l1, l2), in the order of the serial loops;
+    # pairs: the (j1, j2) to compute, e.g. from get_candidate_pairs, by default all of them
+    lines = []
+    if pairs is None:
+        pairs = [(j1, j2) for j1 in get_j_list(l1) for j2 in get_j_list(l2)]
+    for j1, j2 in pairs:
+        if n1==n2 and l1==l2 and abs(j1-j2)<1e-9:
+            continue
+        frequency = atom.getTransitionFrequency(n1, l1, j1, n2, l2, j2)/1e12
+        if frequency < 0: # E1 > E2
+            if check_spontaneous_transition_rule(l1, l2, j1, j2) > 0:
+                rate = atom.getTransitionRate(n1, l1, j1, n2, l2, j2, temperature=temperature)
+                if rate > RATE_CUTOFF:
+                    wavelength = atom.getTransitionWavelength(n1, l1, j1, n2, l2, j2)/1e-9
+                    lines.append(SPON_FORMAT % \
+                        (n1, l1, j1, n2, l2, j2, -frequency, -wavelength, rate))
+    return lines
+
+def sweep_block(atom, n1, n2, l1, l2, pairs=None):
+    # lines of "spontaneous_sweep.dat" of the block (n1, n2, l1, l2), in the order of the serial loops
+    lines = []
+    if pairs is None:
+        pairs = [(j1, j2) for j1 in get_j_list(l1) for j2 in get_j_list(l2)]
+    for j1, j2 in pairs:
+        if n1==n2 and l1==l2 and abs(j1-j2)<1e-9:
+            continue
+        frequency = atom.getTransitionFrequency(n1, l1, j1, n2, l2, j2)
+        if frequency < 0 and check_spontaneous_transition_rule(l1, l2, j1, j2) > 0:
+            rate = atom.getTransitionRate(n1, l1, j1, n2, l2, j2, temperature=0)
+            if rate > 0:
+                wavelength = atom.getTransitionWavelength(n1, l1, j1, n2, l2, j2)/1e-9
+                lines.append(SWEEP_FORMAT % (n1, l1, j1, n2, l2, j2, -frequency, -wavelength, rate))
+    return lines
+
+def get_blackbody_rates(frequency, rate, temperatures):
+    # rates (s^-1) of shape (len(rate), len(temperatures)) from the frequencies (Hz) and the rates at
+    # 0 K: ARC's getTransitionRate is the rate at 0 K times 1 + the thermal occupation of the mode
+    omega = np.abs(2.0 * pi * np.asarray(frequency, dtype=float))[:, None]
+    temperatures = np.asarray(temperatures, dtype=float)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        occupation = np.where((hbar * omega < 100 * C_k * temperatures) & (omega > 1e2),
+                              1.0 / (np.exp(hbar * omega / (C_k * temperatures)) - 1.0), 0.0)
+    return np.asarray(rate, dtype=float)[:, None] * (1.0 + occupation)
+
+def write_sweep(path, temperatures, output=None):
+    # "spontaneous_sweep.npz": the temperatures and the transitions with one rate per temperature,
+    # rates not above RATE_CUTOFF are 0 as the rows missing from "spontaneous.dat"
+    if output is None:
+        output = os.path.splitext(path)[0] + '.npz'
+    data = np.loadtxt(path, ndmin=2) if os.path.getsize(path) else np.zeros((0, 9))
+    transitions = np.zeros(len(data), dtype=get_sweep_dtype(len(temperatures)))
+    for k, name in enumerate(['n_upper', 'l_upper', 'j_upper', 'n_lower', 'l_lower', 'j_lower']):
+        transitions[name] = data[:, k]
+    transitions['freq'] = data[:, 6] / 1e12
+    transitions['wavelength'] = data[:, 7]
+    rate = get_blackbody_rates(data[:, 6], data[:, 8], temperatures)
+    rate[rate <= RATE_CUTOFF] = 0
+    transitions['rate'] = rate
+    with open(output + '.tmp', 'wb') as f:
+        np.savez(f, temperatures=np.asarray(temperatures, dtype=float), transitions=transitions)
+    os.replace(output + '.tmp', output)
+    return output
+
+#### candidate pairs ####
+# the selection rules and the energy ordering only depend on the quantum numbers and the energies of
+# the levels, so they are applied to all (state 1, state 2) pairs at once as array operations, and
+# the blocks only call ARC for the (j1, j2) pairs that can give a line:
+#   both stages: l2 = l1 +- 1 (the angular factor <l1||C1||l2> vanishes otherwise, by parity)
+#                and the 6j triangle rules of check_selection_rule / check_spontaneous_transition_rule
+#   absorption:  n2 >= n1, as the blocks
+#   spontaneous (and sweep): E1 > E2, from the energies of the levels
+
+def get_states(n_start, n_max, l_max=4):
+    # (n, l, j) of all states, in the order of the serial loops
+    return [(n, l, j) for n in range(n_start, n_max) for l in range(0, l_max) for j in get_j_list(l)]
+
+def get_candidate_pairs(stage, n_start, n_max, l_max=4, energies=None):
+    # dict block key -> list of (j1, j2) of the allowed transitions, in the order of the serial loops;
+    # energies: dict (n, l, j) -> energy, required for the spontaneous stage
+    states = get_states(n_start, n_max, l_max)
+    n, l, j = [np.array(x) for x in zip(*states)]
+    i1, i2 = [i.ravel() for i in np.meshgrid(np.arange(len(states)), np.arange(len(states)), indexing='ij')]
+    n1, l1, j1, n2, l2, j2 = n[i1], l[i1], j[i1], n[i2], l[i2], j[i2]
+    mask = np.abs(l1 - l2) == 1
+    if stage == 'absorption':
+        mask &= (n2 >= n1) & get_wigner_6j_mask(j1, 1, j2, l2, 0.5, l1)
+    else:
+        energy = np.array([energies[state] for state in states])
+        mask &= (energy[i1] > energy[i2]) & get_wigner_6j_mask(l1, l2, 1, j2, j1, 0.5)
+    pairs = {}
+    for k in np.flatnonzero(mask):
+        if stage == 'absorption':
+            key = (int(n1[k]), int(l1[k]), int(n2[k]), int(l2[k]))
+        else:
+            key = (int(n1[k]), int(n2[k]), int(l1[k]), int(l2[k]))
+        pairs.setdefault(key, []).append((float(j1[k]), float(j2[k])))
+    return pairs
+
+def get_energies(atom, n_start, n_max, l_max=4):
+    return {state: atom.getEnergy(*state) for state in get_states(n_start, n_max, l_max)}
+
+#### generation stages ####
+# every stage is split into small blocks keyed by quantum numbers, in the nesting order of the serial
+# loops, so that sorting the keys gives the order of the lines in the output file:
+#   levels:      (n, l)
+#   absorption:  (n1, l1, n2, l2)
+#   spontaneous: (n1, n2, l1, l2)
+# blocks sharing the leading quantum numbers form one task of the process pool; finished blocks are
+# kept in a BlockStore, so a larger n range or an interrupted run only computes the missing blocks
+
+STAGES = ['levels', 'absorption', 'spontaneous', 'sweep']
+
+DEFAULT_OUTPUT = {'levels': 'levels.dat', 'absorption': 'absorption.dat', 'spontaneous': 'spontaneous.dat',
+                  'sweep': 'spontaneous_sweep.dat'}
+
+def get_stage_params(stage, atom_name, q, method, temperature):
+    # the parameters the lines of a block depend on; the n and l ranges only select blocks
+    if stage in ['levels', 'sweep']:
+        return {'atom': atom_name}
+    if stage == 'absorption':
+        return {'atom': atom_name, 'q': q, 'method': method}
+    return {'atom': atom_name, 'temperature': temperature}
+
+def get_block_keys(stage, n_start, n_max, l_max=4):
+    if stage == 'levels':
+        return [(n, l) for n in range(n_start, n_max) for l in range(0, l_max)]
+    if stage == 'absorption':
+        return [(n1, l1, n2, l2) for n1 in range(n_start, n_max) for l1 in range(0, l_max)
+                for n2 in range(n1, n_max) for l2 in range(0, l_max)]
+    return [(n1, n2, l1, l2) for n1 in range(n_start, n_max) for n2 in range(n_start, n_max)
+            for l1 in range(0, l_max) for l2 in range(0, l_max)]
+
+def get_task_key(stage, key):
+    if stage == 'absorption':
+        return key[:2]
+    return key[:1]
+
+def run_block(atom, stage, key, params, pairs=None):
+    if stage == 'levels':
+        return levels_block(atom, *key)
+    if stage == 'absorption':
+        return absorption_block(atom, *key, params['q'], params['method'], pairs)
+    if stage == 'sweep':
+        return sweep_block(atom, *key, pairs)
+    return spontaneous_block(atom, *key, params['temperature'], pairs)
+
+#### worker processes ####
+# each worker builds its own (cached) atoms once, one per species, and writes one chunk file per task.
+# ARC atoms share an SQLite database of matrix elements, and creating an atom reloads its table of
+# literature values: atoms are created one at a time, and no worker computes before all are created,
+# otherwise a worker may miss the literature values. Two workers inserting the same new matrix element
+# fail with an IntegrityError, the block is then computed again, the element being in the database.
+
+_worker_atoms = {}
+
+BLOCK_RETRIES = 3
+
+def _init_worker(atom_names, cache_path, cache_size, lock, barrier):
+    instrument.start_worker()
+    for atom_name in atom_names:
+        with lock:
+            atom = instrument.instrument_methods(get_atom(atom_name), CACHED_METHODS, 'arc')
+        if cache_path:
+            atom = CachedAtom(atom, cache_path, max_entries=cache_size)
+        _worker_atoms[atom_name] = atom
+    try:
+        barrier.wait(timeout=600)
+    except threading.BrokenBarrierError:
+        pass
+
+def _run_block_retry(atom, stage, key, params, pairs):
+    for attempt in range(BLOCK_RETRIES):
+        try:
+            return run_block(atom, stage, key, params, pairs)
+        except (sqlite3.IntegrityError, sqlite3.OperationalError):
+            if attempt == BLOCK_RETRIES - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+def _block_worker(task):
+    stage, keys, params, directory, pairs = task
+    atom = _worker_atoms[params['atom']]
+    t0 = time.time()
+    hits, misses = getattr(atom, 'hits', 0), getattr(atom, 'misses', 0)
+    name = "%s%s_%d_%d.dat" % (stage, ''.join('_%03d' % k for k in get_task_key(stage, keys[0])),
+                               os.getpid(), time.time_ns())
+    records = []
+    offset = 0
+    path = os.path.join(directory, name)
+    # stats: the ARC calls of the task when instrumented, merged by run_jobs
+    with instrument.worker_task() as stats:
+        # binary, so that the offsets and lengths of the manifest are byte positions on every platform
+        with open(path + ".tmp", "wb") as f:
+            for key in keys:
+                text = ''.join(_run_block_retry(atom, stage, key, params, None if pairs is None else pairs.get(key, [])))
+                data = text.encode()
+                f.write(data)
+                records.append((key, offset, len(data), text.count('\n')))
+                offset += len(data)
+        os.replace(path + ".tmp", path)
+        if isinstance(atom, CachedAtom):
+            atom.flush()
+            hits, misses = atom.hits - hits, atom.misses - misses
+    return name, records, time.time() - t0, hits, misses, stats
+
+class StageJob():
+    # one stage of one parameter set: its block store, its missing blocks grouped in pool tasks,
+    # and the assembly of the output file once all blocks are computed
+
+    def __init__(self, stage, output=None, atom_name="Rubidium85", n_start=5, n_max=30, l_max=4, q=+1,
+                 method='mj', temperature=300, temperatures=None, store=None, rebuild=False,
+                 checkpoint_interval=10, cache="arc_cache.sqlite", cache_size=5000000, binary=True, verbose=True):
+        if q not in (-1, 0, 1):
+            raise ValueError('invalid polarization q=%s, expected -1, 0 or 1' % q)
+        # the atom is created here first, so that an unknown name fails before the workers create theirs
+        atom = instrument.instrument_methods(get_atom(atom_name), CACHED_METHODS, 'arc')
+        if output is None:
+            output = DEFAULT_OUTPUT[stage]
+        if store is None:
+            store = output + ".blocks"
+        self.stage = stage
+        self.output = output
+        self.atom_name = atom_name
+        self.temperatures = temperatures or [temperature]
+        self.binary = binary
+        self.verbose = verbose
+        params = get_stage_params(stage, atom_name, q, method, temperature)
+        if rebuild:
+            shutil.rmtree(os.path.join(store, get_params_hash(stage, params)), ignore_errors=True)
+        self.blocks = BlockStore(store, stage, params, checkpoint_interval)
+
+        self.keys = get_block_keys(stage, n_start, n_max, l_max)
+        missing = self.blocks.missing(self.keys)
+        # allowed (j1, j2) pairs of the transition blocks; blocks without any are empty
+        pairs = None
+        if missing and stage != 'levels':
+            energies = None
+            if stage in ['spontaneous', 'sweep']:
+                if cache:
+                    atom = CachedAtom(atom, cache, max_entries=cache_size)
+                energies = get_energies(atom, n_start, n_max, l_max)
+                if cache:
+                    atom.close()
+            with instrument.timer('generate.candidates', atom=atom_name, stage=stage) as fields:
+                pairs = get_candidate_pairs(stage, n_start, n_max, l_max, energies)
+                fields['pairs'] = sum(len(p) for p in pairs.values())
+        tasks = {}
+        for key in missing:
+            tasks.setdefault(get_task_key(stage, key), []).append(key)
+        # tasks are ordered by n1, so the heaviest ones (low n1, most n2 partners) are handed out first
+        self.tasks = [(stage, task_keys, params, self.blocks.directory,
+                       None if pairs is None else {key: pairs[key] for key in task_keys if key in pairs})
+                      for task_keys in tasks.values()]
+        self.done = 0
+        if verbose:
+            print("%s: %d of %d blocks to compute" % (output, len(missing), len(self.keys)), flush=True)
+
+    def add_chunk(self, name, records):
+        self.blocks.add_chunk(name, records)
+        self.done += 1
+
+    def finish(self):
+        with instrument.timer('generate.output', atom=self.atom_name, stage=self.stage, output=self.output) as fields:
+            self.blocks.checkpoint()
+            self.blocks.write_output(self.keys, self.output)
+            if self.stage == 'sweep':
+                # the blocks do not depend on the temperatures, a new sweep only evaluates the rates
+                write_sweep(self.output, self.temperatures)
+            elif self.binary:
+                convert(self.output, kind=self.stage)
+            n_rows = self.blocks.count_rows(self.keys)
+            fields['rows'] = n_rows
+        self.blocks.close()
+        instrument.count('rows.' + self.stage, n_rows)
+        if self.verbose:
+            print("%s: %d rows" % (self.output, n_rows), flush=True)
+        return n_rows
+
+def run_jobs(jobs, processes=None, cache="arc_cache.sqlite", cache_size=5000000, verbose=True):
+    # the tasks of all jobs share one process pool and are handed out in the order of the jobs;
+    # every job writes its output as soon as its last task is done. Returns the rows of every job
+    t0 = time.time()
+    n_rows = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        if not job.tasks:
+            n_rows[i] = job.finish()
+    tasks = [(i, task) for i, job in enumerate(jobs) for task in job.tasks]
+    if tasks:
+        processes = processes or os.cpu_count()
+        atom_names = sorted(set(jobs[i].atom_name for i, _ in tasks))
+        lock, barrier = multiprocessing.Lock(), multiprocessing.Barrier(processes)
+        with multiprocessing.Pool(processes, initializer=_init_worker,
+                                  initargs=(atom_names, cache, cache_size, lock, barrier)) as pool:
+            try:
+                results = pool.imap_unordered(_job_worker, tasks)
+                for k, (i, (name, records, elapsed, hits, misses, stats)) in enumerate(results):
+                    job = jobs[i]
+                    job.add_chunk(name, records)
+                    if instrument.enabled:
+                        log_block(job, records, elapsed, hits, misses, stats)
+                    if verbose:
+                        print("[%s %s %d/%d] block %s: %d rows in %.1f s, cache %d hits / %d misses (total %.1f s)" % \
+                            (job.atom_name, job.stage, job.done, len(job.tasks), get_task_key(job.stage, records[0][0]),
+                             sum(r[3] for r in records), elapsed, hits, misses, time.time()-t0), flush=True)
+                    if job.done == len(job.tasks):
+                        n_rows[i] = job.finish()
+            finally:
+                for job in jobs:
+                    job.blocks.checkpoint()
+                    job.blocks.close()
+    if verbose:
+        print("%d rows in %.1f s" % (sum(n_rows), time.time()-t0))
+    return n_rows
+
+def log_block(job, records, elapsed, hits, misses, stats):
+    # one generation task: its ARC calls (cache misses) and their time, the rest being the selection
+    # rules and the formatting of the lines
+    instrument.merge(stats)
+    instrument.count('cache.hits', hits)
+    instrument.count('cache.misses', misses)
+    arc = [t for name, t in stats['timers'].items() if name.startswith('arc.')]
+    instrument.log('generate.block', atom=job.atom_name, stage=job.stage, key=get_task_key(job.stage, records[0][0]),
+                   blocks=len(records), rows=sum(r[3] for r in records), seconds=round(elapsed, 6),
+                   arc_calls=sum(t['count'] for t in arc), arc_seconds=round(sum(t['total'] for t in arc), 6),
+                   cache_hits=hits, cache_misses=misses)
+
+def _job_worker(item):
+    i, task = item
+    return i, _block_worker(task)
+
+def generate(stage, output=None, atom_name="Rubidium85", n_start=5, n_max=30, l_max=4, q=+1,
+             method='mj', temperature=300, temperatures=None, processes=None, store=None, rebuild=False,
+             checkpoint_interval=10, cache="arc_cache.sqlite", cache_size=5000000, binary=True, verbose=True):
+    job = StageJob(stage, output, atom_name, n_start, n_max, l_max, q, method, temperature, temperatures,
+                   store, rebuild, checkpoint_interval, cache, cache_size, binary, verbose)
+    return run_jobs([job], processes, cache, cache_size, verbose)[0]
+
+def generate_levels(output="levels.dat", **kwargs):
+    return generate('levels', output, **kwargs)
+
+def generate_absorption(output="absorption.dat", **kwargs):
+    return generate('absorption', output, **kwargs)
+
+def generate_spontaneous(output="spontaneous.dat", **kwargs):
+    return generate('spontaneous', output, **kwargs)
+
+def generate_sweep(output="spontaneous_sweep.dat", temperatures=(4, 77, 300), **kwargs):
+    return generate('sweep', output, temperatures=list(temperatures), **kwargs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate data files of the ARC calculator.')
+    parser.add_argument('stages', nargs='+', choices=STAGES)
+    parser.add_argument('--atom', default='Rubidium85', help='name of the ARC atom class')
+    parser.add_argument('--n-start', type=int, default=5)
+    parser.add_argument('--n-max', type=int, default=30)
+    parser.add_argument('--l-max', type=int, default=4)
+    parser.add_argument('-q', type=int, choices=(-1, 0, 1), default=+1, help='polarization of the driving field')
+    parser.add_argument('-T', '--temperature', type=float, default=300, help='temperature (K) of spontaneous rates')
+    parser.add_argument('--temperatures', type=float, nargs='+', default=None,
+                        help='temperatures (K) of the sweep stage (default: --temperature)')
+    parser.add_argument('--method', choices=sorted(PAIR_ROWS), default='mj',
+                        help="'mj': one ARC dipole matrix element per (mj1, mj2); "
+                             "'reduced': one reduced matrix element per (n, l, j) pair")
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-o', '--output', default=None, help='output file (only with a single stage)')
+    parser.add_argument('--store', default=None, help='directory of computed blocks (default: <output>.blocks)')
+    parser.add_argument('--rebuild', action='store_true', help='discard the stored blocks of these parameters')
+    parser.add_argument('--checkpoint', type=float, default=10, help='seconds between manifest checkpoints')
+    parser.add_argument('--cache', default='arc_cache.sqlite', help='SQLite cache of ARC quantities')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--cache-size', type=int, default=5000000, help='maximum number of cached values')
+    parser.add_argument('--no-binary', action='store_true', help='do not write the binary (*.npy) files')
+    parser.add_argument('--quiet', action='store_true')
+    parser.add_argument('--instrument', nargs='?', const='1', default=None,
+                        help='log timers and counters as JSON lines, to stderr or to the given file (see instrument.py)')
+    parser.add_argument('--profile', default=None, help='write a cProfile of the run (and <file>.<pid> of the workers)')
+    args = parser.parse_args(argv)
+    if args.output and len(args.stages) > 1:
+        parser.error('--output can only be used with a single stage')
+    instrument.configure(args.instrument, args.profile)
+
+    for stage in args.stages:
+        try:
+            generate(stage, args.output, args.atom, args.n_start, args.n_max, args.l_max, args.q,
+                     method=args.method, temperature=args.temperature, temperatures=args.temperatures,
+                     processes=args.processes,
+                     store=args.store, rebuild=args.rebuild, checkpoint_interval=args.checkpoint,
+                     cache=None if args.no_cache else args.cache, cache_size=args.cache_size,
+                     binary=not args.no_binary, verbose=not args.quiet)
+        except ValueError as e:
+            parser.error(str(e))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import cProfile
+import threading
+import functools
+import contextlib
+
+# Opt-in instrumentation of the generators and the GUI: timers, counters, structured logs and profiles.
+#
+# Everything is off unless enabled by the environment (or the --instrument and --profile options of
+# generate.py and batch.py), so that production runs can be instrumented without editing code; the
+# worker processes of generation inherit the settings:
+#   ARC_INSTRUMENT=1               - log events as JSON lines on stderr
+#   ARC_INSTRUMENT=run.jsonl       - append them to a file
+#   ARC_PROFILE=run.prof           - cProfile of the run or GUI session (pstats file, see python -m pstats);
+#                                    every worker process of generation writes run.prof.<pid>, the
+#                                    loader thread of the GUI run.prof.loader
+# Every log line is one event, e.g.
+#   {"time": 1700000000.0, "pid": 1234, "event": "query.absorption", "seconds": 0.002, "rows": 15, ...}
+# and at exit a "summary" event gives the count, total and max seconds of every timer and the counters.
+#
+#### Events and counters ####
+# generate.candidates, generate.block, generate.output  - selection rules, blocks (ARC calls and time,
+#                                                          cache hits, rows) and output files
+# arc.<method>                                          - ARC calls, that missed the cache
+# load.<step>, query.<kind>, table.fill, signal.<name>  - GUI loading, transition queries, tables, handlers
+
+ENV_INSTRUMENT = 'ARC_INSTRUMENT'
+ENV_PROFILE = 'ARC_PROFILE'
+
+logger = logging.getLogger('arc_calculator')
+
+enabled = False
+counters = {}
+timers = {}
+_profile = None
+# whether a call of an instrumented method is in progress, per thread
+_calls = threading.local()
+
+def configure(instrument=None, profile=None):
+    # enable from the arguments or the environment; the arguments are exported for worker processes
+    global enabled
+    if instrument:
+        os.environ[ENV_INSTRUMENT] = instrument
+    if profile:
+        os.environ[ENV_PROFILE] = profile
+    target = os.environ.get(ENV_INSTRUMENT)
+    if target and not enabled:
+        handler = logging.StreamHandler(sys.stderr) if target in ['1', 'stderr'] else logging.FileHandler(target)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        enabled = True
+        atexit.register(log_summary)
+    if os.environ.get(ENV_PROFILE) and _profile is None:
+        start_profile(os.environ[ENV_PROFILE])
+
+def to_json(value):
+    # numpy scalars and arrays, and anything else as text
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+def log(event, **fields):
+    if enabled:
+        record = {'time': round(time.time(), 6), 'pid': os.getpid(), 'event': event}
+        record.update(fields)
+        logger.info(json.dumps(record, default=to_json))
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+def add_time(name, seconds, n=1):
+    if enabled:
+        stats = timers.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        stats['count'] += n
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+
+@contextlib.contextmanager
+def _timer(name, fields):
+    t0 = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        seconds = time.perf_counter() - t0
+        add_time(name, seconds)
+        log(name, seconds=round(seconds, 6), **fields)
+
+def timer(name, **fields):
+    # context manager timing its block into the timer name and logging it as one event; the fields
+    # known at the end (e.g. the number of rows) are added to the dict it yields
+    if not enabled:
+        return contextlib.nullcontext({})
+    return _timer(name, fields)
+
+def timed(name):
+    # decorator of functions and Qt slots, timed as timer(name)
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_methods(obj, names, prefix):
+    # count and time the calls of the given methods of obj, in place (the type of obj is kept),
+    # e.g. the ARC methods of an atom under "arc.<method>"; the calls are not logged one by one.
+    # Only the outermost call is counted: the methods called by another instrumented method (e.g.
+    # self.getDipoleMatrixElement within ARC's getTransitionRate) are part of its time
+    if not enabled:
+        return obj
+    for name in names:
+        if hasattr(obj, name):
+            setattr(obj, name, _counted(getattr(obj, name), prefix + '.' + name))
+    return obj
+
+def _counted(method, name):
+    @functools.wraps(method)
+    def counted(*args, **kwargs):
+        if getattr(_calls, 'active', False):
+            return method(*args, **kwargs)
+        _calls.active = True
+        t0 = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _calls.active = False
+            add_time(name, time.perf_counter() - t0)
+    return counted
+
+def get_summary():
+    return {'timers': {name: dict(stats) for name, stats in timers.items()}, 'counters': dict(counters)}
+
+def merge(summary):
+    # add the summary of another process, e.g. of a generation task
+    for name, stats in summary['timers'].items():
+        mine = timers.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        mine['count'] += stats['count']
+        mine['total'] += stats['total']
+        mine['max'] = max(mine['max'], stats['max'])
+    for name, n in summary['counters'].items():
+        counters[name] = counters.get(name, 0) + n
+
+def reset():
+    counters.clear()
+    timers.clear()
+
+def log_summary():
+    if enabled:
+        log('summary', **get_summary())
+
+#### profiles ####
+
+def start_profile(path):
+    global _profile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    _profile = (profiler, path)
+    atexit.register(stop_profile)
+
+def stop_profile():
+    global _profile
+    if _profile is not None:
+        profiler, path = _profile
+        profiler.disable()
+        profiler.dump_stats(path)
+        _profile = None
+        log('profile', path=path)
+
+@contextlib.contextmanager
+def thread_profile(name):
+    # cProfile of the calling thread (a profiler only sees the thread that enables it), written to
+    # <profile>.<name> at the end of the block
+    path = os.environ.get(ENV_PROFILE)
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats('%s.%s' % (path, name))
+        log('profile', path='%s.%s' % (path, name))
+
+def start_worker():
+    # in a worker process: no inherited timers or profile, a profile of its own that only runs
+    # within worker_task() and is written after every task
+    global _profile
+    if _profile is not None:
+        _profile[0].disable()
+        _profile = None
+    reset()
+    if os.environ.get(ENV_PROFILE):
+        _profile = (cProfile.Profile(), '%s.%d' % (os.environ[ENV_PROFILE], os.getpid()))
+
+@contextlib.contextmanager
+def worker_task():
+    # one task of a worker process; yields the dict that receives its summary
+    result = {}
+    reset()
+    if _profile is not None:
+        _profile[0].enable()
+    try:
+        yield result
+    finally:
+        if _profile is not None:
+            _profile[0].disable()
+            _profile[0].dump_stats(_profile[1])
+        result.update(get_summary())
+
+configure()
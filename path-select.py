@@ -1,96 +1,330 @@
+import os
+import sys
+import time
+start_time = time.perf_counter()
+
 import numpy as np
 import matplotlib
 matplotlib.use('Qt5Agg')
 
 import PyQt5.QtCore
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
 from PyQt5.QtWidgets import QApplication, QDialog, QWidget, QGridLayout, QGroupBox, \
     QLabel, QLineEdit, QListWidget, QListWidgetItem, \
-    QPushButton, QHBoxLayout, QVBoxLayout, QTableWidget, QTableWidgetItem, QTabWidget, \
-    QSizePolicy
+    QPushButton, QHBoxLayout, QVBoxLayout, QTableView, QTabWidget, \
+    QSizePolicy, QComboBox, QCheckBox, QAbstractItemView, QProgressBar, QMessageBox
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+
+import instrument
+from dataset import Dataset
+from pathsearch import PathSearch, parse_bands
+from schemes import SchemeEvaluator, get_ladders
+from transitionstore import TransitionStore
+from coveragemap import load_coverage, get_best_windows
+
+# loaded by DataLoader once the window is shown; the data directory is the first argument, e.g.
+# a per-species directory of batch.py: python path-select.py data/Caesium
+dataset = Dataset('.', load=False)
+
+def to_table(columns):
+    # columns of a table dialog, as a 2D array of floats
+    table = np.zeros((len(columns[0]), len(columns)))
+    for k, column in enumerate(columns):
+        table[:,k] = column
+    return table
+
+def absorption_table(lines, value_name):
+    lower, upper = dataset.states[lines['lower']], dataset.states[lines['upper']]
+    return to_table([lower['n'], lower['l'], lower['j'], lines['two_mj_lower']/2,
+                     upper['n'], upper['l'], upper['j'], lines['two_mj_upper']/2,
+                     lines[value_name], lines['dipole']])
+
+class ArrayTableModel(QAbstractTableModel):
+    # table model reading directly from a 2D numpy array: cells are formatted only when they are painted,
+    # and sorting/filtering only reorder the permutation self.rows of the array rows, with numpy operations
 
-data_absp = np.loadtxt('absorption.dat')
-data_spon = np.loadtxt("spontaneous.dat")
-data_levl = np.loadtxt("levels.dat")
-
-def reorder_data():
-    # reorder the data so that lower_level -> higher_level, i.e., E1 < E2
-    idx = data_absp[:,8]<0              # find all rows of data with freq < 0
-    data_absp[idx,8] = -data_absp[idx,8]
-    data_absp[idx,9] = -data_absp[idx,9]
-    data_absp[idx,10] = -data_absp[idx,10]
-    tmp, data_absp[idx,0] = data_absp[idx,0], data_absp[idx,4]
-    data_absp[idx,4] = tmp
-    tmp, data_absp[idx,1] = data_absp[idx,1], data_absp[idx,5]
-    data_absp[idx,5] = tmp
-    tmp, data_absp[idx,2] = data_absp[idx,2], data_absp[idx,6]
-    data_absp[idx,6] = tmp
-    tmp, data_absp[idx,3] = data_absp[idx,3], data_absp[idx,7]
-    data_absp[idx,7] = tmp
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.array = np.zeros((0, 0))
+        self.header = []
+        self.rows = np.arange(0)
+        self.mask = None
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+
+    def set_array(self, array, header):
+        self.beginResetModel()
+        self.array = array
+        self.header = header
+        self.mask = None
+        self.sort_column = -1
+        self.update_rows()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.array.shape[1]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.array[self.rows[index.row()], index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.header[section] if section < len(self.header) else None
+        return str(section + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # column -1 restores the order of the array
+        self.beginResetModel()
+        self.sort_column, self.sort_order = column, order
+        self.update_rows()
+        self.endResetModel()
+
+    def set_filter(self, column, lower=None, upper=None, absolute=False):
+        # keep the rows with lower <= value <= upper (or |value|) in the column, None for no bound
+        self.beginResetModel()
+        if column is None:
+            self.mask = None
+        else:
+            try:
+                values = self.array[:, column].astype(float)
+            except (ValueError, TypeError):
+                return self.endResetModel()  # not a numeric column
+            if absolute:
+                values = np.abs(values)
+            self.mask = np.ones(len(values), dtype=bool)
+            if lower is not None:
+                self.mask &= values >= lower
+            if upper is not None:
+                self.mask &= values <= upper
+        self.update_rows()
+        self.endResetModel()
+
+    def update_rows(self):
+        rows = np.arange(len(self.array)) if self.mask is None else np.nonzero(self.mask)[0]
+        if 0 <= self.sort_column < self.array.shape[1]:
+            keys = self.array[rows, self.sort_column]
+            if keys.dtype.kind in 'biuf':
+                if self.sort_order == Qt.DescendingOrder:
+                    keys = -keys
+                rows = rows[np.argsort(keys, kind='stable')]
+            else:
+                rows = rows[np.argsort(keys, kind='stable')]
+                if self.sort_order == Qt.DescendingOrder:
+                    rows = rows[::-1]
+        self.rows = rows
+
+    def get_array_row(self, row):
+        return int(self.rows[row])
 
 class TableWidget(QDialog):
     def __init__(self, sigSelected, parent=None):
         super().__init__(parent)
         self.sigSelected = sigSelected
 
-        self.tableWidget = QTableWidget()
+        self.model = ArrayTableModel(self)
+        self.tableView = QTableView()
+        self.tableView.setModel(self.model)
+        self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.tableView.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.tableView.setSortingEnabled(True)
+
+        self.lblFilter = QLabel("Filter:")
+        self.cmbFilterColumn = QComboBox()
+        self.edtFilterLower = QLineEdit()
+        self.edtFilterLower.setPlaceholderText('min')
+        self.lblDash = QLabel("-")
+        self.edtFilterUpper = QLineEdit()
+        self.edtFilterUpper.setPlaceholderText('max')
+        self.chkFilterAbs = QCheckBox("|value|")
+        self.btnFilter = QPushButton("Filter")
+        self.btnFilter.clicked.connect(self.on_btnFilter_clicked)
+        self.btnFilterReset = QPushButton("Reset")
+        self.btnFilterReset.clicked.connect(self.on_btnFilterReset_clicked)
+        #
+        self.layoutFilter = QHBoxLayout()
+        self.layoutFilter.addWidget(self.lblFilter)
+        self.layoutFilter.addWidget(self.cmbFilterColumn)
+        self.layoutFilter.addWidget(self.edtFilterLower)
+        self.layoutFilter.addWidget(self.lblDash)
+        self.layoutFilter.addWidget(self.edtFilterUpper)
+        self.layoutFilter.addWidget(self.chkFilterAbs)
+        self.layoutFilter.addWidget(self.btnFilter)
+        self.layoutFilter.addWidget(self.btnFilterReset)
+
         self.button = QPushButton("Select")
         self.button.clicked.connect(self.on_button_clicked)
         self.layout = QVBoxLayout(self)
-        self.layout.addWidget(self.tableWidget)
+        self.layout.addLayout(self.layoutFilter)
+        self.layout.addWidget(self.tableView)
         self.layout.addWidget(self.button)
         self.setLayout(self.layout)
         self.setGeometry(300, 300, 1300, 900)
 
     def on_button_clicked(self):
-        idx = self.tableWidget.currentRow()
+        row = self.tableView.currentIndex().row()
+        if row < 0:
+            return
+        # the row of the data array, whatever the sorting and filtering of the view
+        idx = self.model.get_array_row(row)
         self.sigSelected.emit(idx)
         self.close()
 
+    def on_btnFilter_clicked(self):
+        try:
+            lower = float(self.edtFilterLower.text()) if self.edtFilterLower.text().strip() else None
+            upper = float(self.edtFilterUpper.text()) if self.edtFilterUpper.text().strip() else None
+        except ValueError:
+            return
+        self.model.set_filter(self.cmbFilterColumn.currentIndex(), lower, upper, self.chkFilterAbs.isChecked())
+
+    def on_btnFilterReset_clicked(self):
+        self.model.set_filter(None)
+
     def update_data(self, data, header):
-        self.tableWidget.clear()
-        (n_row, n_col) = np.shape(data)
-        self.tableWidget.setRowCount(n_row)
-        self.tableWidget.setColumnCount(n_col)
-        self.tableWidget.setHorizontalHeaderLabels(header)
-        for i in range(n_row):
-            for j in range(n_col):
-                self.tableWidget.setItem(i, j, QTableWidgetItem(str(data[i, j])))
+        with instrument.timer('table.fill', rows=len(data), columns=len(header)):
+            self.tableView.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+            self.model.set_array(data, header)
+            self.cmbFilterColumn.clear()
+            self.cmbFilterColumn.addItems(header)
 
 class ParamsPanel(QWidget):
-    def __init__(self, sigParamSet, parent=None):
+    def __init__(self, sigParamSet, sigWindowsRequested, parent=None):
         super().__init__(parent)
         self.sigParamSet = sigParamSet
+        self.sigWindowsRequested = sigWindowsRequested
 
         self.lblTHzFreq = QLabel("THz frequency range (THz):")
         self.lblDash = QLabel("-")
         #
         self.edtTHzFreqLower = QLineEdit()
         self.edtTHzFreqUpper = QLineEdit()
+        self.lblMinDipole = QLabel("Min. |dipole| (a0*e):")
+        self.edtMinDipole = QLineEdit()
+        self.edtMinDipole.setPlaceholderText('any')
         self.btnTHz = QPushButton("Search...")
+        self.btnTHz.setEnabled(False)
         self.btnTHz.clicked.connect(self.on_btnTHz_clicked)
+        self.btnWindows = QPushButton("Best windows...")
+        self.btnWindows.setEnabled(False)
+        self.btnWindows.clicked.connect(self.on_btnWindows_clicked)
         #
         self.layoutTHz = QHBoxLayout()
         self.layoutTHz.addWidget(self.lblTHzFreq)
         self.layoutTHz.addWidget(self.edtTHzFreqLower)
         self.layoutTHz.addWidget(self.lblDash)
         self.layoutTHz.addWidget(self.edtTHzFreqUpper)
+        self.layoutTHz.addWidget(self.lblMinDipole)
+        self.layoutTHz.addWidget(self.edtMinDipole)
         self.layoutTHz.addWidget(self.btnTHz)
+        self.layoutTHz.addWidget(self.btnWindows)
         #
         self.groupTHz = QGroupBox('THz Parameters - searching in "absorption.dat":')
         self.groupTHz.setLayout(self.layoutTHz)
         #
+        self.lblBands = QLabel("Laser wavelength bands (nm):")
+        self.edtBands = QLineEdit()
+        self.edtBands.setPlaceholderText('e.g. 770-800, 470-490 (empty: any)')
+        self.lblMaxHops = QLabel("Max. hops:")
+        self.edtMaxHops = QLineEdit('4')
+        self.lblTopK = QLabel("Paths:")
+        self.edtTopK = QLineEdit('10')
+        self.lblTemperature = QLabel("Temperature:")
+        self.cmbTemperature = QComboBox()
+        self.cmbTemperature.addItem('spontaneous.dat')
+        self.cmbTemperature.setEnabled(False)
+        #
+        self.layoutSearch = QHBoxLayout()
+        self.layoutSearch.addWidget(self.lblBands)
+        self.layoutSearch.addWidget(self.edtBands)
+        self.layoutSearch.addWidget(self.lblMaxHops)
+        self.layoutSearch.addWidget(self.edtMaxHops)
+        self.layoutSearch.addWidget(self.lblTopK)
+        self.layoutSearch.addWidget(self.edtTopK)
+        self.layoutSearch.addWidget(self.lblTemperature)
+        self.layoutSearch.addWidget(self.cmbTemperature)
+        #
+        self.groupSearch = QGroupBox('Path search - ranking excitation ladders and fluorescence cascades:')
+        self.groupSearch.setLayout(self.layoutSearch)
+        #
+        self.lblPowers = QLabel("Laser powers (mW):")
+        self.edtPowers = QLineEdit('10')
+        self.edtPowers.setPlaceholderText('per step from the ground state, e.g. 10, 100')
+        self.lblWaists = QLabel("Beam waists (um):")
+        self.edtWaists = QLineEdit('100')
+        self.lblDetect = QLabel("Detection bands (nm):")
+        self.edtDetect = QLineEdit()
+        self.edtDetect.setPlaceholderText('e.g. 770-800 (empty: any)')
+        self.lblSchemes = QLabel("Schemes:")
+        self.edtSchemes = QLineEdit('200')
+        #
+        self.layoutSchemes = QHBoxLayout()
+        self.layoutSchemes.addWidget(self.lblPowers)
+        self.layoutSchemes.addWidget(self.edtPowers)
+        self.layoutSchemes.addWidget(self.lblWaists)
+        self.layoutSchemes.addWidget(self.edtWaists)
+        self.layoutSchemes.addWidget(self.lblDetect)
+        self.layoutSchemes.addWidget(self.edtDetect)
+        self.layoutSchemes.addWidget(self.lblSchemes)
+        self.layoutSchemes.addWidget(self.edtSchemes)
+        #
+        self.groupSchemes = QGroupBox('Scheme evaluation - ranking the ladders by Rabi frequency and detected fluorescence:')
+        self.groupSchemes.setLayout(self.layoutSchemes)
+        #
         self.layout = QVBoxLayout()
         self.layout.addWidget(self.groupTHz)
+        self.layout.addWidget(self.groupSearch)
+        self.layout.addWidget(self.groupSchemes)
 
         self.setLayout(self.layout)
 
     def on_btnTHz_clicked(self):
         self.sigParamSet.emit()
 
+    def on_btnWindows_clicked(self):
+        self.sigWindowsRequested.emit()
+
+    def set_THz_window(self, freq_lower, freq_upper):
+        self.edtTHzFreqLower.setText('%g' % freq_lower)
+        self.edtTHzFreqUpper.setText('%g' % freq_upper)
+
+    def set_temperatures(self, temperatures):
+        # item 0 is "spontaneous.dat", then the temperatures of the sweep
+        for temperature in temperatures:
+            self.cmbTemperature.addItem('%g K' % temperature, float(temperature))
+        self.cmbTemperature.setEnabled(len(temperatures) > 0)
+
+    def get_temperature(self):
+        # None for the rates of "spontaneous.dat"
+        return self.cmbTemperature.currentData()
+
+    def get_search_params(self):
+        # (k, max_hops, bands) of the path search; ValueError for an empty or invalid field
+        return int(self.edtTopK.text()), int(self.edtMaxHops.text()), parse_bands(self.edtBands.text())
+
+    def get_scheme_params(self):
+        # (powers (W), waists (m), detection bands, number of schemes) of the scheme evaluation;
+        # ValueError for an empty or invalid field
+        powers = [float(x)*1e-3 for x in self.edtPowers.text().replace(';', ',').split(',') if x.strip()]
+        waists = [float(x)*1e-6 for x in self.edtWaists.text().replace(';', ',').split(',') if x.strip()]
+        if not powers or not waists:
+            raise ValueError('laser powers and beam waists are required')
+        return powers, waists, parse_bands(self.edtDetect.text()), int(self.edtSchemes.text())
+
 class PlotCanvas(FigureCanvas):
+    # The energy-level diagram of all levels is the background of the figure: it is drawn once and
+    # cached as a bitmap, and the artists of the scheme (Rydberg levels, exci_path, spon_path) are
+    # animated artists updated in place and blitted over the cached background.
     def __init__(self, parent=None, width=6, height=4):
         fig = Figure(figsize=(width, height), dpi=100)
         FigureCanvas.__init__(self, fig)
@@ -98,36 +332,77 @@ class PlotCanvas(FigureCanvas):
         FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
         self.ax = self.figure.add_subplot(1, 1, 1)
-
-    def plot(self, data):
-        self.ax.cla()
-        # draw levels of upper and lower Rydberg levels
-        self.ax.hlines(data.lower_rydberg_level[4], data.lower_rydberg_level[1]-0.2, data.lower_rydberg_level[1]+0.2, colors='k')
-        self.ax.hlines(data.upper_rydberg_level[4], data.upper_rydberg_level[1]-0.2, data.upper_rydberg_level[1]+0.2, colors='k')
-        
-        if data.exci_path: # if the list is not empty
-            for i, path in enumerate(data.exci_path):
-                # draw levels of exci_path
-                self.ax.hlines(path[4], path[1]-0.2, path[1]+0.2, colors='r')
-                # draw transitions of exci_path
-                if i == 0:
-                    self.ax.plot([path[1], data.lower_rydberg_level[1]], [path[4], data.lower_rydberg_level[4]], 'r')
-                else:
-                    self.ax.plot([path[1], data.exci_path[i-1][1]], [path[4], data.exci_path[i-1][4]], 'r')
-        
-        if data.spon_path: # if the list is not empty
-            for i, path in enumerate(data.spon_path):
-                # draw levels of spon_path
-                self.ax.hlines(path[3], path[1]-0.2, path[1]+0.2, colors='g')
-                # draw transitions of spon_path
-                if i == 0:
-                    self.ax.plot([data.upper_rydberg_level[1], path[1]], [data.upper_rydberg_level[4], path[3]], 'g')
-                else:
-                    self.ax.plot([data.spon_path[i-1][1], path[1]], [data.spon_path[i-1][3], path[3]], 'g')
-
         self.ax.set_xlabel('l number')
         self.ax.set_ylabel('Energy (eV)')
-        self.draw()
+
+        self.background = None
+        self.scheme = {'rydberg': LineCollection([], colors='k', animated=True),
+                       'exci': LineCollection([], colors='r', animated=True),
+                       'spon': LineCollection([], colors='g', animated=True)}
+        self.segments = {}
+        for artist in self.scheme.values():
+            self.ax.add_collection(artist)
+        self.mpl_connect('draw_event', self.on_draw)
+
+    def plot_levels(self, states):
+        # background: all levels with a known energy, as one collection
+        states = states[np.isfinite(states['energy'])]
+        l, energy = states['l'].astype(float), states['energy']
+        self.ax.add_collection(LineCollection(np.stack([np.column_stack([l-0.2, energy]),
+                                                        np.column_stack([l+0.2, energy])], axis=1),
+                                              colors='0.8', linewidths=0.5))
+        margin = 0.05 * (energy.max() - energy.min())
+        self.ax.set_xlim(-0.5, l.max()+0.5)
+        self.ax.set_ylim(energy.min()-margin, energy.max()+margin)
+        self.draw_idle()
+
+    def on_draw(self, event):
+        # a full draw (first show, resize) renders the background only: cache it and draw the scheme over it
+        self.background = self.copy_from_bbox(self.ax.bbox)
+        self.draw_scheme()
+
+    def draw_scheme(self):
+        for artist in self.scheme.values():
+            self.ax.draw_artist(artist)
+
+    def get_scheme_segments(self, data):
+        rydberg, exci, spon = [], [], []
+        for level in [data.lower_rydberg_level, data.upper_rydberg_level]:
+            if level:
+                rydberg.append([(level[1]-0.2, level[4]), (level[1]+0.2, level[4])])
+        # transitions of exci_path go down from the lower Rydberg level, those of spon_path
+        # go down from the upper Rydberg level
+        if data.lower_rydberg_level:
+            previous = (data.lower_rydberg_level[1], data.lower_rydberg_level[4])
+            for path in data.exci_path:
+                exci.append([(path[1]-0.2, path[4]), (path[1]+0.2, path[4])])
+                exci.append([(path[1], path[4]), previous])
+                previous = (path[1], path[4])
+        if data.upper_rydberg_level:
+            previous = (data.upper_rydberg_level[1], data.upper_rydberg_level[4])
+            for path in data.spon_path:
+                spon.append([(path[1]-0.2, path[3]), (path[1]+0.2, path[3])])
+                spon.append([previous, (path[1], path[3])])
+                previous = (path[1], path[3])
+        return {'rydberg': rydberg, 'exci': exci, 'spon': spon}
+
+    def plot(self, data):
+        # add, update or remove only the scheme artists whose segments changed, then blit
+        segments = self.get_scheme_segments(data)
+        changed = False
+        for name, segs in segments.items():
+            if segs != self.segments.get(name):
+                self.scheme[name].set_segments(segs)
+                self.segments[name] = segs
+                changed = True
+        if not changed:
+            return
+        if self.background is None:
+            self.draw_idle()
+            return
+        self.restore_region(self.background)
+        self.draw_scheme()
+        self.blit(self.ax.bbox)
 
 class SchemeData():
 
@@ -142,10 +417,11 @@ class SchemeData():
 
 
 class ResultsPanel(QWidget):
-    def __init__(self, sigExciPathSelected, sigSponPathSelected, parent=None):
+    def __init__(self, sigExciPathSelected, sigSponPathSelected, sigBestPathsRequested, parent=None):
         super().__init__(parent)
         self.sigExciPathSelected = sigExciPathSelected
         self.sigSponPathSelected = sigSponPathSelected
+        self.sigBestPathsRequested = sigBestPathsRequested
 
         self.lblTHzDetect = QLabel('')
 
@@ -158,13 +434,25 @@ class ResultsPanel(QWidget):
         self.btnRydLevLower = QPushButton('Select excitation path(s)...')
         self.btnRydLevLower.setEnabled(False)
         self.btnRydLevLower.clicked.connect(self.on_btnRydLevLower_clicked)
+        self.btnBestSpon = QPushButton('Best fluorescence cascades...')
+        self.btnBestSpon.setEnabled(False)
+        self.btnBestSpon.clicked.connect(self.on_btnBestSpon_clicked)
+        self.btnBestExci = QPushButton('Best excitation ladders...')
+        self.btnBestExci.setEnabled(False)
+        self.btnBestExci.clicked.connect(self.on_btnBestExci_clicked)
+        self.btnRankSchemes = QPushButton('Rank schemes...')
+        self.btnRankSchemes.setEnabled(False)
+        self.btnRankSchemes.clicked.connect(self.on_btnRankSchemes_clicked)
 
         self.layout = QGridLayout()
 
         self.layout.addWidget(self.lblTHzDetect,   0, 0, 1, 1)
-        self.layout.addWidget(self.lblRydLevUpper, 1, 0, 1, 3)
+        self.layout.addWidget(self.btnRankSchemes, 0, 3, 1, 1)
+        self.layout.addWidget(self.lblRydLevUpper, 1, 0, 1, 2)
+        self.layout.addWidget(self.btnBestSpon,    1, 2, 1, 1)
         self.layout.addWidget(self.btnRydLevUpper, 1, 3, 1, 1)
-        self.layout.addWidget(self.lblRydLevLower, 2, 0, 1, 3)
+        self.layout.addWidget(self.lblRydLevLower, 2, 0, 1, 2)
+        self.layout.addWidget(self.btnBestExci,    2, 2, 1, 1)
         self.layout.addWidget(self.btnRydLevLower, 2, 3, 1, 1)
 
         self.tabPaths = QTabWidget()
@@ -227,6 +515,15 @@ class ResultsPanel(QWidget):
     def on_btnRydLevLower_clicked(self):
         self.sigExciPathSelected.emit('seek-exci-0')
 
+    def on_btnBestSpon_clicked(self):
+        self.sigBestPathsRequested.emit('best-spon')
+
+    def on_btnBestExci_clicked(self):
+        self.sigBestPathsRequested.emit('best-exci')
+
+    def on_btnRankSchemes_clicked(self):
+        self.sigBestPathsRequested.emit('rank-schemes')
+
     def on_btnSponPaths_clicked(self):
         self.sigSponPathSelected.emit('seek-spon')
 
@@ -244,9 +541,64 @@ class ResultsPanel(QWidget):
         pass
 
 def get_energy_and_lifetime(n, l, j):
-    line = data_levl[(data_levl[:,0]==n) & (data_levl[:,1]==l) & (data_levl[:,2]==j)][0]
-    return line[3], line[4]
+    # ValueError for a level that is not in the state table
+    state = dataset.states[dataset.get_state_id(n, l, j)]
+    return state['energy'], state['lifetime']
+
 
+class DataLoader(PyQt5.QtCore.QThread):
+    # Loads the dataset in a worker thread, step by step: sigReady(name) is emitted when the data of
+    # a step can be used, so that the window shows at once and the controls unlock progressively.
+    sigProgress = PyQt5.QtCore.pyqtSignal(int, str)
+    sigReady = PyQt5.QtCore.pyqtSignal(str)
+    sigFailed = PyQt5.QtCore.pyqtSignal(str)
+
+    steps = [('states', 'Loading levels and transitions...'),
+             ('absorption', 'Indexing absorption...'),
+             ('coverage', 'Mapping THz coverage...'),
+             ('spontaneous', 'Indexing spontaneous radiation...'),
+             ('search', 'Preparing path search...')]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pathSearch = None
+        self.evaluator = None
+        self.coverage = None
+        self.times = {}
+
+    def run(self):
+        # the profile of the session only sees the main thread: the loader thread has a profile of its own
+        with instrument.thread_profile('loader'):
+            self.load_steps()
+
+    def load_steps(self):
+        run_step = {'states': dataset.load,
+                    'absorption': dataset.build_absorption_indexes,
+                    'coverage': self.load_coverage,
+                    'spontaneous': self.load_spontaneous,
+                    'search': self.build_path_search}
+        try:
+            for i, (name, text) in enumerate(self.steps):
+                self.sigProgress.emit(i, text)
+                with instrument.timer('load.' + name, directory=dataset.directory):
+                    run_step[name]()
+                self.times[name] = time.perf_counter() - start_time
+                self.sigReady.emit(name)
+            self.sigProgress.emit(len(self.steps), 'Data ready in %.2f s' % (time.perf_counter() - start_time))
+        except Exception as e:
+            self.sigFailed.emit('Loading failed: ' + str(e))
+
+    def load_coverage(self):
+        # "coverage.npy" of the data directory, computed on first use
+        self.coverage = load_coverage(dataset)
+
+    def load_spontaneous(self):
+        dataset.build_spontaneous_indexes()
+        dataset.load_sweep()
+
+    def build_path_search(self):
+        self.pathSearch = PathSearch(dataset)
+        self.evaluator = SchemeEvaluator(dataset)
 
 class MainWidget(QWidget):
     # signals
@@ -254,6 +606,8 @@ class MainWidget(QWidget):
     signal_param_set = PyQt5.QtCore.pyqtSignal() # panel of parameters
     signal_exci_path_selected = PyQt5.QtCore.pyqtSignal(str)
     signal_spon_path_selected = PyQt5.QtCore.pyqtSignal(str)
+    signal_best_paths_requested = PyQt5.QtCore.pyqtSignal(str)
+    signal_windows_requested = PyQt5.QtCore.pyqtSignal()
     
 
     def __init__(self, parent=None):
@@ -266,6 +620,15 @@ class MainWidget(QWidget):
         self.signal_param_set.connect(self.on_param_set)
         self.signal_exci_path_selected.connect(self.list_exci_paths)
         self.signal_spon_path_selected.connect(self.list_spon_radiation)
+        self.signal_best_paths_requested.connect(self.list_best_paths)
+        self.signal_windows_requested.connect(self.list_coverage_windows)
+
+        self.pathSearch = None
+        self.evaluator = None
+        self.absorptionStore = None
+        self.spontaneousStore = None
+        self.coverage = None
+        self.ready = set()
 
         self.on_level_selected_at_stage = {\
             'init':self.on_thz_levels_ready, \
@@ -273,42 +636,152 @@ class MainWidget(QWidget):
             'seek-exci-0':self.on_exci_src_level_found, \
             'seek-spon-0':self.on_spon_des_level_found, \
             'seek-exci':self.on_exci_src_level_found, \
-            'seek-spon':self.on_spon_des_level_found}
+            'seek-spon':self.on_spon_des_level_found, \
+            'best-exci':self.on_best_exci_path_selected, \
+            'best-spon':self.on_best_spon_path_selected, \
+            'rank-schemes':self.on_ranked_scheme_selected, \
+            'coverage':self.on_coverage_window_selected}
         
-        self.panelParams = ParamsPanel(self.signal_param_set, self)
-        self.panelResults = ResultsPanel(self.signal_exci_path_selected, self.signal_spon_path_selected, self)
+        self.panelParams = ParamsPanel(self.signal_param_set, self.signal_windows_requested, self)
+        self.panelResults = ResultsPanel(self.signal_exci_path_selected, self.signal_spon_path_selected, \
+            self.signal_best_paths_requested, self)
         self.dlgTHzSelcTable = TableWidget(self.signal_level_selected, self)
         self.dlgSponTransTable = TableWidget(self.signal_level_selected, self)
         self.dlgExciTransTable = TableWidget(self.signal_level_selected, self)
+        self.dlgBestPathsTable = TableWidget(self.signal_level_selected, self)
+        self.dlgSchemesTable = TableWidget(self.signal_level_selected, self)
+        self.dlgWindowsTable = TableWidget(self.signal_level_selected, self)
+
+        self.barLoading = QProgressBar()
+        self.barLoading.setRange(0, len(DataLoader.steps))
+        self.lblLoading = QLabel('')
+        self.layoutLoading = QHBoxLayout()
+        self.layoutLoading.addWidget(self.lblLoading)
+        self.layoutLoading.addWidget(self.barLoading)
 
         self.layoutMain = QVBoxLayout()
         self.layoutMain.addWidget(self.panelParams)
         self.layoutMain.addWidget(self.panelResults)
+        self.layoutMain.addLayout(self.layoutLoading)
 
         self.setLayout(self.layoutMain)      
 
+        self.loader = DataLoader(self)
+        self.loader.sigProgress.connect(self.on_loading_progress)
+        self.loader.sigReady.connect(self.on_data_ready)
+        self.loader.sigFailed.connect(self.lblLoading.setText)
+
+    def load_data(self):
+        self.loader.start()
+
+    def on_loading_progress(self, step, text):
+        self.barLoading.setValue(step)
+        self.lblLoading.setText(text)
+        if step == len(DataLoader.steps):
+            self.barLoading.setVisible(False)
+
+    def on_data_ready(self, name):
+        instrument.log('data_ready', step=name, seconds=round(self.loader.times[name], 6))
+        self.ready.add(name)
+        if name == 'states':
+            self.panelResults.canvas.plot_levels(dataset.states)
+        elif name == 'absorption':
+            self.absorptionStore = TransitionStore(dataset, 'absorption')
+        elif name == 'coverage':
+            self.coverage = self.loader.coverage
+        elif name == 'spontaneous':
+            self.spontaneousStore = TransitionStore(dataset, 'spontaneous')
+        elif name == 'search':
+            self.pathSearch = self.loader.pathSearch
+            self.evaluator = self.loader.evaluator
+            # the temperature is only selectable once the loader no longer reads the spontaneous rows,
+            # so that the path search is never built from the rates of another temperature
+            if dataset.temperatures is not None:
+                self.panelParams.set_temperatures(dataset.temperatures)
+                self.panelParams.cmbTemperature.currentIndexChanged.connect(self.on_temperature_changed)
+        self.update_controls()
+
+    @instrument.timed('signal.temperature_changed')
+    def on_temperature_changed(self, index):
+        # the rates of the sweep are in memory: only the spontaneous rows and index are replaced
+        dataset.set_temperature(self.panelParams.get_temperature())
+        self.spontaneousStore = TransitionStore(dataset, 'spontaneous')
+        self.pathSearch.update_spontaneous()
+        self.evaluator.update_spontaneous()
+        # the tables of spontaneous rows, best paths and ranked schemes hold rows (or rates) of the previous
+        # temperature: they are closed, and a selection pending in one of them is dropped
+        self.best_paths = None
+        self.ranked_schemes = None
+        self.data_tblSpon = None
+        for dlg in [self.dlgSponTransTable, self.dlgBestPathsTable, self.dlgSchemesTable]:
+            dlg.hide()
+        if self.curr_status in ['seek-spon-0', 'seek-spon', 'best-exci', 'best-spon', 'rank-schemes']:
+            self.curr_status = 'thz-ready'
+        instrument.log('temperature', temperature=dataset.temperature)
+
+    def update_controls(self):
+        # controls are enabled once the data they query is loaded
+        selected = bool(self.data.upper_rydberg_level)
+        self.panelParams.btnTHz.setEnabled('absorption' in self.ready)
+        self.panelParams.btnWindows.setEnabled('coverage' in self.ready)
+        self.panelResults.btnRydLevLower.setEnabled(selected and 'absorption' in self.ready)
+        self.panelResults.btnRydLevUpper.setEnabled(selected and 'spontaneous' in self.ready)
+        self.panelResults.btnBestExci.setEnabled(selected and 'search' in self.ready)
+        self.panelResults.btnBestSpon.setEnabled(selected and 'search' in self.ready)
+        self.panelResults.btnRankSchemes.setEnabled(selected and 'search' in self.ready)
+
     def set_THz_range(self):
+        # the fields are read before anything is reset, so that an invalid one leaves the selection as it was
+        try:
+            freq_lower = float(self.panelParams.edtTHzFreqLower.text())
+            freq_upper = float(self.panelParams.edtTHzFreqUpper.text())
+            min_dipole = float(self.panelParams.edtMinDipole.text()) if self.panelParams.edtMinDipole.text().strip() else None
+        except ValueError as e:
+            QMessageBox.warning(self, 'THz range', 'Invalid THz range: ' + str(e))
+            return
         self.curr_status = 'init'
         self.data.reset()
         self.panelResults.clear()
-        freq_lower = float(self.panelParams.edtTHzFreqLower.text())
-        freq_upper = float(self.panelParams.edtTHzFreqUpper.text())
-        freq = abs(data_absp[:,8])
-        lines = data_absp[(freq>freq_lower) & (freq<freq_upper)]
-        self.data_tblTHz = np.delete(lines, 9, 1) # remove the column of 'wavelength'
+        _, lines = self.absorptionStore.select(freq=(freq_lower, freq_upper), min_dipole=min_dipole)
+        self.data_tblTHz = absorption_table(lines, 'freq')
         header = ['n_lower', 'l_lower', 'j_lower', 'mj_lower', 'n_upper', 'l_upper', 'j_upper', 'mj_upper', 'Freq. (THz)', 'dipole']
         self.dlgTHzSelcTable.update_data(self.data_tblTHz, header)
         self.dlgTHzSelcTable.show()
     
+    @instrument.timed('signal.param_set')
     def on_param_set(self):
         self.set_THz_range()
 
+    @instrument.timed('signal.windows_requested')
+    def list_coverage_windows(self):
+        # when 'Best windows...' is clicked, show the 1 GHz bins of the coverage map with lines,
+        # strongest first; selecting one searches its THz range
+        self.curr_status = 'coverage'
+        self.windows = get_best_windows(self.coverage)
+        lower, upper = dataset.states[self.windows['lower']], dataset.states[self.windows['upper']]
+        table = to_table([self.windows['freq_lower'], self.windows['freq_upper'], self.windows['max_dipole'],
+                          self.windows['count'], lower['n'], lower['l'], lower['j'], self.windows['two_mj_lower']/2,
+                          upper['n'], upper['l'], upper['j'], self.windows['two_mj_upper']/2])
+        header = ['Freq. lower (THz)', 'Freq. upper (THz)', 'max |dipole|', 'lines',
+                  'n_lower', 'l_lower', 'j_lower', 'mj_lower', 'n_upper', 'l_upper', 'j_upper', 'mj_upper']
+        self.dlgWindowsTable.update_data(table, header)
+        self.dlgWindowsTable.show()
+
+    def on_coverage_window_selected(self, idx):
+        window = self.windows[idx]
+        self.panelParams.set_THz_window(window['freq_lower'], window['freq_upper'])
+        self.set_THz_range()
+
+    @instrument.timed('signal.level_selected')
     def on_level_selected(self, idx):
-        self.on_level_selected_at_stage[self.curr_status](idx)
-        print('table clicked - curr_status: ', self.curr_status)
-        print('exci_path:', self.data.exci_path)
-        print('spon_path:', self.data.spon_path)
-        print('--------------------------')
+        try:
+            self.on_level_selected_at_stage[self.curr_status](idx)
+        except ValueError as e:
+            # e.g. a level that is not in the state table
+            QMessageBox.warning(self, 'Level selection', str(e))
+            return
+        instrument.log('level_selected', status=self.curr_status, row=idx,
+                       exci_path=self.data.exci_path, spon_path=self.data.spon_path)
 
     def on_thz_levels_ready(self, idx):
         self.curr_status = 'thz-ready'
@@ -328,17 +801,15 @@ class MainWidget(QWidget):
         energy, lifetime = get_energy_and_lifetime(n, l, j)
         self.data.lower_rydberg_level = [n, l, j, mj, energy, lifetime]
 
-        self.panelResults.btnRydLevUpper.setEnabled(True)
-        self.panelResults.btnRydLevLower.setEnabled(True)
+        self.update_controls()
 
         self.panelResults.updateCanvas(self.data)
 
     def selc_step_2(self, idx):
-        print('selc_step_2')
+        pass
 
     def on_exci_src_level_found(self, idx):
         # when close the table of absorption transtion, with level selected and curr_status = seek-exci-0 or seek-exci
-        print('exci_src_level_found:', idx)
         if self.curr_status == 'seek-exci-0':
             self.data.exci_path = []
 
@@ -351,7 +822,6 @@ class MainWidget(QWidget):
 
     def on_spon_des_level_found(self, idx):
         # when close the table of spontaneous transtion, with level selected and curr_status = seek-spon-0 or seek-spon
-        print('spon_des_level_found:', idx)
         if self.curr_status == 'seek-spon-0':
             self.data.spon_path = []
 
@@ -362,6 +832,7 @@ class MainWidget(QWidget):
         self.panelResults.add_spon_path(self.data.spon_path)
         self.panelResults.updateCanvas(self.data)
 
+    @instrument.timed('signal.spon_path_selected')
     def list_spon_radiation(self, status):
         # when 'Select fluorescence transition...' or 'Add...' button in the 'Spon path' tab 
         # is clicked, show the transition table
@@ -371,15 +842,19 @@ class MainWidget(QWidget):
         elif self.curr_status == 'seek-spon':
             n, l, j = self.data.spon_path[-1][:3]
         else:
-            print('Unknown curr_status')
-        print('n', n, 'l', l, 'j', j)
-
-        lines = data_spon[(data_spon[:,0]==n) & (data_spon[:,1]==l) & (data_spon[:,2]==j)]
-        self.data_tblSpon = np.delete(lines, 6, 1) # remove the column of 'Freq.'
+            instrument.log('unknown_status', status=status)
+            return
+        instrument.log('spon_level', status=status, n=n, l=l, j=j)
+
+        _, lines = self.spontaneousStore.select(upper=dataset.get_state_id(n, l, j))
+        upper, lower = dataset.states[lines['upper']], dataset.states[lines['lower']]
+        self.data_tblSpon = to_table([upper['n'], upper['l'], upper['j'], lower['n'], lower['l'], lower['j'],
+                                      lines['wavelength'], lines['rate']])
         header = ['n_upper', 'l_upper', 'j_upper', 'n_lower', 'l_lower', 'j_lower', 'λ (nm)', 'rate']
         self.dlgSponTransTable.update_data(self.data_tblSpon, header)
         self.dlgSponTransTable.show()
 
+    @instrument.timed('signal.exci_path_selected')
     def list_exci_paths(self, status):
         # when 'Select excitation path(s)...' or 'Add...' button in the 'Exci path' tab 
         # is clicked, show the transition table
@@ -389,21 +864,129 @@ class MainWidget(QWidget):
         elif self.curr_status == 'seek-exci':
             n, l, j, mj = self.data.exci_path[-1][:4]
         else:
-            print('Unknown curr_status')
-        print('n', n, 'l', l, 'j', j, 'mj', mj)
+            instrument.log('unknown_status', status=status)
+            return
+        instrument.log('exci_level', status=status, n=n, l=l, j=j, mj=mj)
 
-        lines = data_absp[(data_absp[:,4]==n) & (data_absp[:,5]==l) & (data_absp[:,6]==j) & (data_absp[:,7]==mj)]
-        self.data_tblExci = np.delete(lines, 8, 1) # remove the column of 'Freq.'
+        _, lines = self.absorptionStore.select(upper=dataset.get_state_id(n, l, j), two_mj_upper=round(2*mj))
+        self.data_tblExci = absorption_table(lines, 'wavelength')
         header = ['n_lower', 'l_lower', 'j_lower', 'mj_lower', 'n_upper', 'l_upper', 'j_upper', 'mj_upper', 'λ (nm)', 'dipole']
         self.dlgExciTransTable.update_data(self.data_tblExci, header)
         self.dlgExciTransTable.show()
 
+    def get_exci_path_level(self, row):
+        # level of exci_path reached from the absorption row, i.e. its lower level
+        line = dataset.absp[row]
+        state = dataset.states[line['lower']]
+        return [float(state['n']), float(state['l']), float(state['j']), line['two_mj_lower']/2, \
+            state['energy'], state['lifetime'], line['wavelength'], line['dipole']]
+
+    def get_spon_path_level(self, row):
+        # level of spon_path reached by the spontaneous row, i.e. its lower level
+        line = dataset.spon[row]
+        state = dataset.states[line['lower']]
+        return [float(state['n']), float(state['l']), float(state['j']), \
+            state['energy'], state['lifetime'], line['wavelength'], line['rate']]
+
+    @instrument.timed('signal.best_paths_requested')
+    def list_best_paths(self, status):
+        # when 'Best excitation ladders...' or 'Best fluorescence cascades...' is clicked,
+        # show the table of ranked paths
+        if status == 'rank-schemes':
+            self.list_ranked_schemes()
+            return
+        try:
+            k, max_hops, bands = self.panelParams.get_search_params()
+        except ValueError as e:
+            QMessageBox.warning(self, 'Path search', 'Invalid search parameters: ' + str(e))
+            return
+        self.curr_status = status
+        if status == 'best-exci':
+            n, l, j, mj = self.data.lower_rydberg_level[:4]
+            self.best_paths = self.pathSearch.search_excitation_paths(dataset.get_state_id(n, l, j), round(2*mj), \
+                k=k, max_hops=max_hops, bands=bands)
+            paths = [[self.get_exci_path_level(row) for row in rows] for _, rows in self.best_paths]
+            header = ['rank', 'product of |dipole|', 'hops', 'path (ground -> lower Rydberg level)']
+        else:
+            n, l, j = self.data.upper_rydberg_level[:3]
+            # the laser bands only constrain the excitation
+            self.best_paths = self.pathSearch.search_fluorescence_paths(dataset.get_state_id(n, l, j), \
+                k=k, max_hops=max_hops)
+            paths = [[self.get_spon_path_level(row) for row in rows] for _, rows in self.best_paths]
+            header = ['rank', 'branching ratio', 'hops', 'path (upper Rydberg level -> ground)']
+
+        table = np.empty((len(paths), 4), dtype=object)
+        for i, ((score, rows), levels) in enumerate(zip(self.best_paths, paths)):
+            if status == 'best-exci':
+                text = ''.join('(%d, %d, %s, %s) -[%.1f nm]-> ' % (lv[0], lv[1], lv[2], lv[3], lv[6]) for lv in levels[::-1])
+                text += '(%d, %d, %s, %s)' % (n, l, j, mj)
+            else:
+                text = '(%d, %d, %s)' % (n, l, j)
+                text += ''.join(' -[%.1f nm]-> (%d, %d, %s)' % (lv[5], lv[0], lv[1], lv[2]) for lv in levels)
+            table[i] = [i+1, score, len(rows), text]
+        self.dlgBestPathsTable.update_data(table, header)
+        self.dlgBestPathsTable.show()
+
+    def list_ranked_schemes(self):
+        # when 'Rank schemes...' is clicked: the best excitation ladders to the lower Rydberg level,
+        # with the fluorescence of the upper Rydberg level, evaluated at once and ranked by score
+        try:
+            _, max_hops, bands = self.panelParams.get_search_params()
+            powers, waists, detect_bands, n_schemes = self.panelParams.get_scheme_params()
+        except ValueError as e:
+            QMessageBox.warning(self, 'Rank schemes', 'Invalid scheme parameters: ' + str(e))
+            return
+        self.curr_status = 'rank-schemes'
+        n, l, j, mj = self.data.lower_rydberg_level[:4]
+        self.best_paths = self.pathSearch.search_excitation_paths(dataset.get_state_id(n, l, j), round(2*mj), \
+            k=n_schemes, max_hops=max_hops, bands=bands)
+        if not self.best_paths:
+            QMessageBox.information(self, 'Rank schemes', 'No ladder found to the lower Rydberg level ' \
+                'within the laser bands and the max. hops.')
+            return
+        ladder, two_mj = get_ladders(dataset, [rows for _, rows in self.best_paths])
+        upper = dataset.get_state_id(*self.data.upper_rydberg_level[:3])
+        self.ranked_schemes = self.evaluator.rank(self.evaluator.evaluate(ladder, two_mj, upper, powers, waists, detect_bands))
+
+        header = ['rank', 'score', 'min. Rabi (MHz)', 'detected photons', 'min. lifetime (ns)', 'hops',
+                  'ladder (ground -> lower Rydberg level)']
+        table = np.empty((len(self.ranked_schemes), len(header)), dtype=object)
+        for i, result in enumerate(self.ranked_schemes):
+            levels = [self.get_exci_path_level(row) for row in self.best_paths[result['scheme']][1]][::-1]
+            text = ''.join('(%d, %d, %s, %s) -[%.1f nm, %.3g MHz]-> ' % (lv[0], lv[1], lv[2], lv[3], lv[6], rabi) \
+                for lv, rabi in zip(levels, result['rabi']))
+            text += '(%d, %d, %s, %s)' % (n, l, j, mj)
+            table[i] = [i+1, result['score'], result['min_rabi'], result['detected'], result['lifetime'], result['hops'], text]
+        self.dlgSchemesTable.update_data(table, header)
+        self.dlgSchemesTable.show()
+
+    def on_ranked_scheme_selected(self, idx):
+        rows = self.best_paths[self.ranked_schemes['scheme'][idx]][1]
+        self.data.exci_path = [self.get_exci_path_level(row) for row in rows]
+        self.panelResults.add_exci_path(self.data.exci_path)
+        self.panelResults.updateCanvas(self.data)
+
+    def on_best_exci_path_selected(self, idx):
+        self.data.exci_path = [self.get_exci_path_level(row) for row in self.best_paths[idx][1]]
+        self.panelResults.add_exci_path(self.data.exci_path)
+        self.panelResults.updateCanvas(self.data)
+
+    def on_best_spon_path_selected(self, idx):
+        self.data.spon_path = [self.get_spon_path_level(row) for row in self.best_paths[idx][1]]
+        self.panelResults.add_spon_path(self.data.spon_path)
+        self.panelResults.updateCanvas(self.data)
+
 
 if __name__ == '__main__':
 
-    reorder_data()
+    if len(sys.argv) > 1:
+        dataset = Dataset(sys.argv[1], load=False)
 
     app = QApplication([])
     mainWidget = MainWidget()
+    mainWidget.setWindowTitle('path-select - ' + os.path.abspath(dataset.directory))
     mainWidget.show()
+    app.processEvents()
+    instrument.log('window_shown', seconds=round(time.perf_counter() - start_time, 6))
+    mainWidget.load_data()
     app.exec_()
\ No newline at end of file
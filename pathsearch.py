@@ -0,0 +1,122 @@
+import heapq
+
+import numpy as np
+
+# Search of the best excitation and fluorescence paths over the level graph of a Dataset.
+#
+# States are the nodes of the graph. Excitation edges are the absorption rows (lower, mj) -> (upper, mj),
+# with cost -log|dipole|, so that the cheapest ladder has the largest product of dipoles. Decay edges are
+# the spontaneous rows upper -> lower, with cost -log(branching ratio), so that the cheapest cascade is
+# the most probable one. Every transition goes up (absorption) or down (spontaneous) in energy, so the
+# graph is acyclic, and a best-first search that settles every (node, hops) at most k times returns the
+# k best paths in order. The hops are part of the node, since a path with fewer hops can still go further.
+#
+# Excitation costs are negative for |dipole| > 1, so the ladders are searched by A*: the priority of a
+# partial ladder is its cost minus (max_hops - hops)*log(max(dipole_max, 1)), a lower bound of the cost
+# of any ladder that completes it (consistent, since no edge costs less than -log(dipole_max)), and
+# complete ladders are queued with their exact cost. Ladders come out in decreasing product of |dipole|,
+# whatever their number of hops.
+
+def parse_bands(text):
+    # "770-800, 470-490" -> [(770, 800), (470, 490)], None for an empty text; ValueError for a malformed band
+    bands = []
+    for item in text.replace(';', ',').split(','):
+        if item.strip():
+            try:
+                lower, upper = item.split('-')
+                bands.append((float(lower), float(upper)))
+            except ValueError:
+                raise ValueError('invalid band "%s", expected lower-upper in nm, e.g. 770-800' % item.strip())
+    return bands or None
+
+def in_bands(wavelength, bands):
+    if bands is None:
+        return np.ones(np.shape(wavelength), dtype=bool)
+    wavelength = np.abs(wavelength)
+    allowed = np.zeros(np.shape(wavelength), dtype=bool)
+    for lower, upper in bands:
+        allowed |= (wavelength >= lower) & (wavelength <= upper)
+    return allowed
+
+class PathSearch():
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        energy = np.array(dataset.states['energy'])
+        self.ground = int(np.nanargmin(energy))
+
+        dipole = np.abs(np.asarray(dataset.absp['dipole']))
+        with np.errstate(divide='ignore'):
+            self.exci_cost = -np.log(dipole)
+        # the largest decrease of cost per hop, for the bound of the excitation search
+        self.exci_bound = max(float(np.log(dipole.max())), 0.0) if len(dipole) else 0.0
+
+        self.update_spontaneous()
+
+    def update_spontaneous(self):
+        # branching ratios of the spontaneous rows, again after Dataset.set_temperature
+        spon = self.dataset.spon
+        rate = np.asarray(spon['rate'])
+        self.total_rate = np.bincount(spon['upper'], weights=rate, minlength=len(self.dataset.states))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.branching = rate / self.total_rate[spon['upper']]
+            self.spon_cost = -np.log(self.branching)
+
+    def search_excitation_paths(self, state_id, two_mj, k=5, max_hops=4, bands=None, ground=None):
+        # best k ladders from the ground state to the level (state_id, mj), as lists of absorption rows
+        # from the target level downwards (the order of SchemeData.exci_path), with the product of |dipole|
+        if ground is None:
+            ground = self.ground
+        absp = self.dataset.absp
+        results = []
+        pops = {}
+        # (priority, counter, cost, state, 2*mj, rows), state -1 for a complete ladder
+        heap = [(-max_hops * self.exci_bound, 0, 0.0, state_id, two_mj, ())]
+        counter = 1
+        while heap and len(results) < k:
+            _, _, cost, sid, tmj, rows = heapq.heappop(heap)
+            if sid < 0:
+                results.append((float(np.prod(np.abs(absp['dipole'][list(rows)]))), list(rows)))
+                continue
+            key = (sid, tmj, len(rows))
+            if pops.get(key, 0) >= k or len(rows) >= max_hops:
+                continue
+            pops[key] = pops.get(key, 0) + 1
+            edges = self.dataset.get_absorption_rows_to(sid, tmj)
+            edges = edges[in_bands(absp['wavelength'][edges], bands) & np.isfinite(self.exci_cost[edges])]
+            bound = (max_hops - len(rows) - 1) * self.exci_bound
+            for row, lower, two_mj_lower, edge_cost in zip(edges.tolist(), absp['lower'][edges].tolist(),
+                                                           absp['two_mj_lower'][edges].tolist(), self.exci_cost[edges].tolist()):
+                if lower == ground:
+                    heapq.heappush(heap, (cost + edge_cost, counter, cost + edge_cost, -1, 0, rows + (row,)))
+                else:
+                    heapq.heappush(heap, (cost + edge_cost - bound, counter, cost + edge_cost, lower, two_mj_lower, rows + (row,)))
+                counter += 1
+        return results
+
+    def search_fluorescence_paths(self, state_id, k=5, max_hops=4, bands=None, target=None):
+        # best k cascades from state_id to the target state (by default the ground state), as lists of
+        # spontaneous rows from the upper level downwards (the order of SchemeData.spon_path),
+        # with their total branching ratio
+        if target is None:
+            target = self.ground
+        spon = self.dataset.spon
+        results = []
+        pops = {}
+        heap = [(0.0, 0, state_id, ())]
+        counter = 1
+        while heap and len(results) < k:
+            cost, _, sid, rows = heapq.heappop(heap)
+            if sid == target and rows:
+                results.append((float(np.prod(self.branching[list(rows)])), list(rows)))
+                continue
+            key = (sid, len(rows))
+            if pops.get(key, 0) >= k or len(rows) >= max_hops:
+                continue
+            pops[key] = pops.get(key, 0) + 1
+            edges = self.dataset.get_spontaneous_rows_from(sid)
+            edges = edges[in_bands(spon['wavelength'][edges], bands) & np.isfinite(self.spon_cost[edges])]
+            for row, lower, edge_cost in zip(edges.tolist(), spon['lower'][edges].tolist(), self.spon_cost[edges].tolist()):
+                heapq.heappush(heap, (cost + edge_cost, counter, lower, rows + (row,)))
+                counter += 1
+        return results
@@ -1,6 +1,21 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+
+import instrument
+from dataset import Dataset, normalize, get_paths
+from transitionstore import TransitionStore
+from cascade import Cascade
+from coveragemap import load_coverage
 
 matplotlib.rc('font', family='Times New Roman', size=10)
 matplotlib.rc('axes', labelsize=10, labelpad=2)
@@ -8,16 +23,69 @@ matplotlib.rc('xtick', labelsize=8)
 matplotlib.rc('ytick', labelsize=8)
 matplotlib.rc('lines', linewidth=1.0, markersize=4.0)
 matplotlib.rc('image', cmap='jet')
+# the settings above, which every figure of render() starts from
+RC_PARAMS = {k: v for k, v in matplotlib.rcParams.items() if k != 'backend'}
 
 l_notion = ['s', 'p', 'd', 'f']
 
-def plot_absorption_spectra():
+# Every plot function shows its figure, or with output (a file name) saves it and closes it, e.g. with
+# the Agg backend in scripts and worker processes. render() draws many figures across a process pool:
+#
+#   python plot.py --render figures.json -j 8
+#
+#### Figures file (JSON) ####
+# {"figures": [{"figure": "absorption", "directory": "data/Rubidium85", "output": "figures/Rb85-absorption.png"},
+#              {"figure": "diagram", "directory": "data/Caesium", "temperature": 77, "output": "figures/Cs-77K.png"},
+#              {"figure": "cascade", "directory": "data/Caesium", "n": 30, "l": 1, "j": 1.5, "output": "figures/Cs-30p.png"}]}
+# figure: one of FIGURES, the other keys are the arguments of its function. A figure is only drawn again
+# if its arguments, its data files or its code (this file and FIGURE_MODULES) changed since it was saved:
+# the hash of these is kept per output directory in "plot_cache.json".
+
+def load_dataset(directory='.', temperature=None, indexes=True):
+    # the dataset of the directory, with the spontaneous rates of a temperature of its sweep
+    dataset = Dataset(directory, indexes=indexes)
+    if temperature is not None:
+        dataset.load_sweep()
+        if dataset.temperatures is None:
+            raise ValueError('no spontaneous_sweep.npz in ' + directory)
+        dataset.set_temperature(temperature)
+    return dataset
+
+def show_or_save(fig, output=None):
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+        plt.close(fig)
+
+def get_vline_segments(x, y):
+    # segments (x, 0) -> (x, y) of vertical lines, for a LineCollection
+    segments = np.zeros((len(x), 2, 2))
+    segments[:, :, 0] = x[:, None]
+    segments[:, 1, 1] = y
+    return segments
+
+def aggregate_lines(x, y, lower, upper, bins):
+    # level of detail: the highest line y in every bin of [lower, upper], for x sorted
+    i0, i1 = np.searchsorted(x, lower), np.searchsorted(x, upper, side='right')
+    x, y = x[i0:i1], y[i0:i1]
+    if len(x) <= bins:
+        return x, y
+    idx = ((x - lower) / (upper - lower) * bins).astype(int)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))
+    return lower + (idx[starts] + 0.5) * (upper - lower) / bins, np.maximum.reduceat(y, starts)
+
+def plot_absorption_spectra(directory='.', lod='auto', bins=2000, output=None):
+    # lod: draw the highest line per frequency bin (True), all lines (False), or the binned lines
+    # only above 20000 lines ('auto'); the bins follow the visible range when zooming and panning
 
     matplotlib.rc('figure', figsize=(3.54, 0.8), dpi=300)
     matplotlib.rc('figure.subplot', left=0.08, bottom=0.25,
                   right=0.99, top=0.96, wspace=0.15, hspace=0)
 
-    data = np.loadtxt("absorption.dat")
+    # only the lines to draw are read, chunk by chunk
+    store = TransitionStore(Dataset(directory, indexes=False), 'absorption')
+    _, data = store.select(freq=(0, np.inf), min_dipole=1e-8)
     fig = plt.figure()
     ax = plt.axes()
 
@@ -28,25 +96,52 @@ def plot_absorption_spectra():
     # idx 9: wavelength (nm)
     # idx 10: dipole moment (a0*e)
 
-    for line in data:
-        dipole = np.abs(line[10])
-        freq = line[8]
-        if dipole > 1e-8:
-            if freq > 0:
-                ax.vlines(np.log10(+freq), 0, dipole, colors='g', lw=0.2)
-            else:
-                ax.vlines(np.log10(-freq), 0, dipole, colors='g', lw=0.2)
+    x, y = np.log10(data['freq']), np.abs(data['dipole'])
+    if lod == 'auto':
+        lod = len(x) > 20000
+
+    lines = LineCollection([], colors='g', lw=0.2)
+    ax.add_collection(lines)
+    if lod:
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+
+        def on_xlim_changed(ax):
+            lower, upper = ax.get_xlim()
+            lines.set_segments(get_vline_segments(*aggregate_lines(x, y, lower, upper, bins)))
+
+        ax.callbacks.connect('xlim_changed', on_xlim_changed)
+    else:
+        lines.set_segments(get_vline_segments(x, y))
 
     ax.set_xlim([-0.5228, 0.4771])
     ax.set_ylim([0, 450])
     ax.set_xlabel("Frequency (THz)")
     ax.set_ylabel("Dipole moment (a0*e)")
-    plt.show()
+    show_or_save(fig, output)
+
+def plot_thz_coverage(directory='.', freq_min=0.1, freq_max=3.0, resolution=1e-3, output=None):
+    # the strongest |dipole| and the number of absorption lines per bin of the THz coverage map
+
+    coverage = load_coverage(Dataset(directory), freq_min, freq_max, resolution)
+    edges = np.append(coverage['freq_lower'], coverage['freq_upper'][-1])
 
-def plot_spontaneous_transition_diagram():
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
+    ax1.stairs(coverage['max_dipole'], edges, color='g')
+    ax1.set_ylabel("Max. |dipole| (a0*e)")
+    ax1.set_title("THz coverage (%g GHz bins)" % (resolution*1e3))
+    ax2.stairs(coverage['count'], edges, color='k')
+    ax2.set_yscale('symlog', linthresh=1)
+    ax2.set_xlim([freq_min, freq_max])
+    ax2.set_xlabel("Frequency (THz)")
+    ax2.set_ylabel("Lines")
+    show_or_save(fig, output)
 
-    data_spon = np.loadtxt("spontaneous.dat")
-    data_levl = np.loadtxt("levels.dat")
+def plot_spontaneous_transition_diagram(directory='.', labels=True, min_rate=None, temperature=None, output=None):
+    # min_rate: only draw the transitions with a higher rate (s^-1); temperature: rates of the sweep
+
+    dataset = load_dataset(directory, temperature, indexes=False)
+    data_levl = dataset.states
 
     #### Data format of file "spontaneous.dat" ####
     # idx 0: n_upper | idx 1: l_upper | idx 2: j_upper
@@ -64,88 +159,207 @@ def plot_spontaneous_transition_diagram():
     ax = plt.axes()
 
     # plot energy levels
-    for levl in data_levl:
-        num_l, energy, lifetime = int(levl[1]), levl[3], levl[4]
-        if lifetime > 1e5:
-            ax.hlines(energy, num_l-0.2, num_l+0.2, lw=5)
-        else:
-            ax.hlines(energy, num_l-0.2, num_l+0.2, lw=lifetime/2e3)
-        ax.text(num_l+0.0, energy, "(%d%s%3.1f)" % (levl[0], l_notion[num_l], levl[2]))    
-
-    for spon in data_spon:
-        n_upper, l_upper, j_upper = spon[0], spon[1], spon[2] 
-        n_lower, l_lower, j_lower = spon[3], spon[4], spon[5]
-        E_upper = data_levl[(data_levl[:,0]==n_upper) & 
-                            (data_levl[:,1]==l_upper) &
-                            (data_levl[:,2]==j_upper)][0][3]
-        E_lower = data_levl[(data_levl[:,0]==n_lower) & 
-                            (data_levl[:,1]==l_lower) &
-                            (data_levl[:,2]==j_lower)][0][3]
-        rate = spon[8]
-        if rate > 1e7:
-            ax.plot([l_upper, l_lower], [E_upper, E_lower], lw=8)
-        elif rate > 1e6 and rate <= 1e7:
-            ax.plot([l_upper, l_lower], [E_upper, E_lower], lw=4)
-        else:
-            ax.plot([l_upper, l_lower], [E_upper, E_lower], lw=4*rate/1e6)
+    num_l, energy, lifetime = data_levl['l'].astype(int), data_levl['energy'], data_levl['lifetime']
+    widths = np.where(lifetime > 1e5, 5, lifetime/2e3)
+    ax.hlines(energy, num_l-0.2, num_l+0.2, lw=widths)
+    for levl in data_levl if labels else []:
+        ax.text(levl['l']+0.0, levl['energy'], "(%d%s%3.1f)" % (levl['n'], l_notion[int(levl['l'])], levl['j']))
+
+    # plot spontaneous transitions, with states looked up by their IDs
+    _, spon = TransitionStore(dataset, 'spontaneous').select(min_rate=min_rate)
+    upper, lower = data_levl[spon['upper']], data_levl[spon['lower']]
+    segments = np.zeros((len(spon), 2, 2))
+    segments[:, 0, 0], segments[:, 0, 1] = upper['l'], upper['energy']
+    segments[:, 1, 0], segments[:, 1, 1] = lower['l'], lower['energy']
+    rate = spon['rate']
+    widths = np.where(rate > 1e7, 8, np.where(rate > 1e6, 4, 4*rate/1e6))
+    # the colors of the lines cycle as for separate ax.plot calls
+    colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+    ax.add_collection(LineCollection(segments, linewidths=widths,
+                                     colors=[colors[i % len(colors)] for i in range(len(spon))]))
+    ax.autoscale_view()
     ax.set_xlabel("l number")
     ax.set_ylabel("Energy (eV)")
     ax.set_title("Transition diagram of spontaneous radiation")
-    plt.show()
+    show_or_save(fig, output)
 
-# not yet completed - it will recursively visit all lower levels, some of which have already been plotted 
-def plot_spontaneous_rate():
-    
-    data_spon = np.loadtxt("spontaneous.dat")
-    data_levl = np.loadtxt("levels.dat")
+def plot_spontaneous_rate(n=10, l=1, j=1.5, directory='.', temperature=None, output=None):
+
+    dataset = load_dataset(directory, temperature)
+    data_levl = dataset.states
+    cascade = Cascade(dataset)
 
     fig = plt.figure()
     ax = plt.axes()
 
-    def plot_rate(n, l, j):
-
-        data_upper = data_spon[(data_spon[:,0]==n) & (data_spon[:,1]==l) & (data_spon[:,2]==j)]
-        if data_upper.size == 0:
-            return
-
-        lower_n_list, lower_l_list, lower_j_list = data_upper[:,3], data_upper[:,4], data_upper[:,5]
-        rate_list = data_upper[:,8]
-
-        high_level = data_levl[(data_levl[:,0]==n) & \
-                               (data_levl[:,1]==l) & \
-                               (data_levl[:,2]==j)][0]
-
-        for i in range(len(data_upper)):
-            plot_rate(lower_n_list[i], lower_l_list[i], lower_j_list[i])
-            low_level = data_levl[(data_levl[:,0]==lower_n_list[i]) & \
-                             (data_levl[:,1]==lower_l_list[i]) & \
-                             (data_levl[:,2]==lower_j_list[i])][0]
-            life_time = (low_level[4])
-            ### plot level
-            #if life_time > 1e5:
-            #    ax.hlines(low_level[3], low_level[1]-0.2, low_level[1]+0.2, lw=5)
-            #else:
-            #    ax.hlines(low_level[3], low_level[1]-0.2, low_level[1]+0.2, lw=life_time/2e3)
-            #ax.text(low_level[1]+0.2, low_level[3], "(%d, %d, %3.1f)" % (low_level[0], low_level[1], low_level[2]))
-            ### plot spontaneous transition
-            ax.plot([high_level[1], low_level[1]], [high_level[3], low_level[3]], lw=rate_list[i]/1e6)
-
-        life_time = high_level[4]
+    # every level and transition of the cascade from (n, l, j) is visited once
+    passing, flux = cascade.populations(dataset.get_state_id(n, l, j))
+
+    for row in np.nonzero(flux)[0]:
+        high_level, low_level = data_levl[cascade.upper[row]], data_levl[cascade.lower[row]]
+        ### plot spontaneous transition
+        ax.plot([high_level['l'], low_level['l']], [high_level['energy'], low_level['energy']], lw=cascade.rate[row]/1e6)
+
+    for level in data_levl[np.nonzero(passing)[0]]:
+        life_time = level['lifetime']
         if life_time > 1e5: 
-            ax.hlines(high_level[3], high_level[1]-0.2, high_level[1]+0.2, lw=5)
+            ax.hlines(level['energy'], level['l']-0.2, level['l']+0.2, lw=5)
         else:
-            ax.hlines(high_level[3], high_level[1]-0.2, high_level[1]+0.2, lw=life_time/2e3)
-        ax.text(high_level[1]+0.2, high_level[3], "%d%s%3.1f" % \
-            (high_level[0], l_notion[int(high_level[1])], high_level[2]))    
+            ax.hlines(level['energy'], level['l']-0.2, level['l']+0.2, lw=life_time/2e3)
+        ax.text(level['l']+0.2, level['energy'], "%d%s%3.1f" % \
+            (level['n'], l_notion[int(level['l'])], level['j']))    
+
+    ax.set_xlabel("l number")
+    ax.set_ylabel("Energy (eV)")
+    show_or_save(fig, output)
+
+#### batch rendering ####
+
+FIGURES = {'absorption': plot_absorption_spectra, 'diagram': plot_spontaneous_transition_diagram,
+           'cascade': plot_spontaneous_rate, 'coverage': plot_thz_coverage}
+
+# data files each figure is drawn from, in a directory normalized by dataset.py
+FIGURE_DATA = {'absorption': ['states', 'absorption.ids'], 'diagram': ['states', 'spontaneous.ids'],
+               'cascade': ['states', 'spontaneous.ids'], 'coverage': ['states', 'absorption.ids']}
+
+# modules the figures are computed by, besides this file: their code is part of the cache key
+FIGURE_MODULES = ['dataset', 'datafile', 'transitionstore', 'cascade', 'coveragemap']
+
+CACHE_FILE = 'plot_cache.json'
 
-    plot_rate(10, 1, 1.5)
-    plt.show()
-    
+def get_file_hash(path, hashes):
+    # sha256 of a file, computed once per path into the dict hashes
+    if path not in hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                digest.update(block)
+        hashes[path] = digest.hexdigest()
+    return hashes[path]
 
+def get_figure_hash(figure, hashes):
+    # hash of the arguments of a figure, its data files and the code that draws it
+    paths = get_paths(figure.get('directory', '.'))
+    names = FIGURE_DATA[figure['figure']] + (['sweep'] if figure.get('temperature') is not None else [])
+    key = {'figure': {k: v for k, v in figure.items() if k != 'output'},
+           'data': [get_file_hash(paths[name], hashes) for name in names],
+           'code': [get_file_hash(os.path.abspath(path), hashes)
+                    for path in [__file__] + [sys.modules[name].__file__ for name in FIGURE_MODULES]]}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
 
+def load_cache(directory):
+    path = os.path.join(directory, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_cache(directory, cache):
+    path = os.path.join(directory, CACHE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def _init_renderer():
+    plt.switch_backend('Agg')
+
+def render_figure(figure):
+    # draw one figure into its output file, with the rc settings of this file whatever the figures before
+    params = {k: v for k, v in figure.items() if k not in ['figure', 'output']}
+    t0 = time.time()
+    with matplotlib.rc_context(RC_PARAMS):
+        FIGURES[figure['figure']](output=figure['output'], **params)
+    return figure['output'], time.time() - t0
+
+def render(figures, processes=None, cache=True, verbose=True):
+    # draw the figures (dicts as in a figures file) headless, those not in the cache across a process
+    # pool; returns the output files drawn and those up to date
+    figures = [dict(figure) for figure in figures]
+    hashes = {}
+    for figure in figures:
+        if figure.get('figure') not in FIGURES:
+            raise ValueError('unknown figure: %s' % figure.get('figure'))
+        if 'output' not in figure:
+            raise ValueError('no output file of figure %s' % figure['figure'])
+        figure.setdefault('directory', '.')
+    if len(set(figure['output'] for figure in figures)) < len(figures):
+        raise ValueError('two figures are saved to the same file')
+    # normalized once, before the workers read the data
+    for directory in set(figure['directory'] for figure in figures):
+        normalize(directory)
+
+    caches = {}
+    todo, done = [], []
+    for figure in figures:
+        directory, name = os.path.split(os.path.abspath(figure['output']))
+        os.makedirs(directory, exist_ok=True)
+        if directory not in caches:
+            caches[directory] = load_cache(directory)
+        figure_hash = get_figure_hash(figure, hashes)
+        if cache and caches[directory].get(name) == figure_hash and os.path.exists(figure['output']):
+            done.append(figure['output'])
+        else:
+            todo.append((figure, directory, name, figure_hash))
+
+    t0 = time.time()
+    rendered = []
+    if todo:
+        if processes == 1 or len(todo) == 1:
+            pool = None
+            _init_renderer()
+            results = map(render_figure, [figure for figure, _, _, _ in todo])
+        else:
+            pool = multiprocessing.Pool(min(processes or os.cpu_count(), len(todo)), initializer=_init_renderer)
+            results = pool.imap(render_figure, [figure for figure, _, _, _ in todo])
+        try:
+            for (figure, directory, name, figure_hash), (output, elapsed) in zip(todo, results):
+                caches[directory][name] = figure_hash
+                rendered.append(output)
+                instrument.log('plot.render', figure=figure['figure'], output=output, seconds=round(elapsed, 6))
+                if verbose:
+                    print('%s: %s in %.1f s' % (output, figure['figure'], elapsed), flush=True)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            for directory in set(directory for _, directory, _, _ in todo):
+                save_cache(directory, caches[directory])
+    if verbose:
+        print('%d figures drawn in %.1f s, %d up to date' % (len(rendered), time.time() - t0, len(done)))
+    return rendered, done
 
-#plot_absorption_spectra()
-plot_spontaneous_transition_diagram()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Figures of the data files.')
+    parser.add_argument('directory', nargs='?', default='.',
+                        help='data directory, e.g. a per-species directory of batch.py: python plot.py data/Caesium')
+    parser.add_argument('--figure', choices=sorted(FIGURES), default='diagram')
+    parser.add_argument('-T', '--temperature', type=float, default=None,
+                        help='temperature (K) of the sweep, for the diagram and the cascade')
+    parser.add_argument('-o', '--output', default=None, help='save the figure (headless) instead of showing it')
+    parser.add_argument('--render', default=None, help='figures file (JSON) to draw headless, see plot.py')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes of --render')
+    parser.add_argument('--no-cache', action='store_true', help='draw all figures of --render again')
+    args = parser.parse_args(argv)
 
-#plot_spontaneous_rate() # not yet done, so don't try - taking long time to run
+    if args.render:
+        with open(args.render) as f:
+            figures = json.load(f)['figures']
+        try:
+            render(figures, args.processes, cache=not args.no_cache)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    params = {'directory': args.directory}
+    if args.temperature is not None:
+        if args.figure not in ['diagram', 'cascade']:
+            parser.error('--temperature applies to the diagram and the cascade')
+        params['temperature'] = args.temperature
+    if args.output:
+        plt.switch_backend('Agg')
+    try:
+        FIGURES[args.figure](output=args.output, **params)
+    except ValueError as e:
+        # e.g. a level of the cascade that is not in the data files
+        parser.error(str(e))
 
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,149 @@
+import numpy as np
+from scipy.constants import pi, hbar, e as C_e, c as C_c, epsilon_0, physical_constants
+
+from cascade import Cascade
+from pathsearch import in_bands
+
+# Batch evaluation of excitation and detection schemes.
+#
+# A scheme is an excitation ladder of levels (n, l, j, mj), from the ground state up to the level
+# reached by the lasers (the lower Rydberg level), and the level whose fluorescence is detected (the
+# upper Rydberg level, coupled by the THz field). Schemes are given as arrays of state IDs, one row
+# per scheme, and all figures of merit are computed for the whole batch at once:
+#   rabi      - Rabi frequency Omega/2pi (MHz) of every laser step, from the |dipole| of the absorption
+#               row of the step and the peak field of a Gaussian beam of the given power and waist
+#   min_rabi  - the weakest step of the ladder
+#   detected  - expected number of fluorescence photons in the detection bands per atom in the
+#               detected level, over all the cascades from it (see Cascade.detected_photons)
+#   lifetime  - the shortest lifetime (ns) of the excited levels of the scheme
+#   score     - min_rabi * detected, 0 for a scheme with a step that is not in "absorption.dat"
+#
+#### Arrays of a batch ####
+# ladder (n_schemes, n_levels)  - state IDs from the ground state upwards, padded with -1 at the end
+# two_mj (n_schemes, n_levels)  - 2*mj of the levels of ladder
+# upper (n_schemes)             - state ID of the detected level, -1 for the top level of the ladder
+# powers (W), waists (m)        - of the laser of every step, from the ground state upwards: a scalar,
+#                                 one value per step, or one per scheme and step
+
+a0 = physical_constants['Bohr radius'][0]
+
+def get_step_values(values, n_steps):
+    # one value per laser step, the last value repeated for the further steps
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    if values.size == 0:
+        raise ValueError('no value for the laser steps')
+    if values.ndim == 1:
+        return np.concatenate([values[:n_steps], np.full(max(0, n_steps - len(values)), values[-1])])
+    return values
+
+def get_rabi_frequency(dipole, power, waist):
+    # Omega/2pi (MHz) of a transition dipole (a0*e) at the center of a Gaussian beam
+    intensity = 2 * power / (pi * waist**2)
+    field = np.sqrt(2 * intensity / (C_c * epsilon_0))
+    return np.abs(dipole) * C_e * a0 * field / hbar / (2 * pi) / 1e6
+
+def get_ladders(dataset, paths):
+    # ladder and two_mj arrays of excitation paths given as lists of absorption rows from the top level
+    # downwards, as returned by PathSearch.search_excitation_paths
+    n_levels = max([len(rows) for rows in paths], default=0) + 1
+    ladder = -np.ones((len(paths), n_levels), dtype=np.int64)
+    two_mj = np.zeros((len(paths), n_levels), dtype=np.int64)
+    for i, rows in enumerate(paths):
+        lines = dataset.absp[list(rows)[::-1]]
+        ladder[i, 0], two_mj[i, 0] = lines['lower'][0], lines['two_mj_lower'][0]
+        ladder[i, 1:len(rows)+1], two_mj[i, 1:len(rows)+1] = lines['upper'], lines['two_mj_upper']
+    return ladder, two_mj
+
+class SchemeEvaluator():
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        absp = dataset.absp
+        self.n_states = len(dataset.states)
+        # absorption rows by (lower, mj, upper, mj), for the lookup of the steps
+        self.max_two_mj = int(max(np.abs(absp['two_mj_lower']).max(), np.abs(absp['two_mj_upper']).max())) if len(absp) else 0
+        keys = self.get_keys(absp['lower'], absp['two_mj_lower'], absp['upper'], absp['two_mj_upper'])
+        self.key_order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.key_order]
+        self.dipole = np.abs(np.asarray(absp['dipole']))
+        lifetime = np.asarray(dataset.states['lifetime'], dtype=float)
+        self.lifetime = np.where(np.isnan(lifetime), np.inf, lifetime)
+        self.update_spontaneous()
+
+    def update_spontaneous(self):
+        # cascades of the spontaneous rows, again after Dataset.set_temperature
+        self.cascade = Cascade(self.dataset)
+        self.photons = {}
+
+    def get_keys(self, lower, two_mj_lower, upper, two_mj_upper):
+        width = 2*self.max_two_mj + 1
+        lower, upper = np.asarray(lower, dtype=np.int64), np.asarray(upper, dtype=np.int64)
+        two_mj_lower = np.asarray(two_mj_lower, dtype=np.int64) + self.max_two_mj
+        two_mj_upper = np.asarray(two_mj_upper, dtype=np.int64) + self.max_two_mj
+        return ((lower * width + two_mj_lower) * self.n_states + upper) * width + two_mj_upper
+
+    def get_rows(self, lower, two_mj_lower, upper, two_mj_upper):
+        # absorption row of every (lower, mj) -> (upper, mj), -1 if there is none
+        known = (lower >= 0) & (upper >= 0) & (np.abs(two_mj_lower) <= self.max_two_mj) & \
+            (np.abs(two_mj_upper) <= self.max_two_mj)
+        keys = self.get_keys(np.where(known, lower, 0), np.where(known, two_mj_lower, 0),
+                             np.where(known, upper, 0), np.where(known, two_mj_upper, 0))
+        position = np.minimum(np.searchsorted(self.sorted_keys, keys), max(len(self.sorted_keys) - 1, 0))
+        if len(self.sorted_keys) == 0:
+            return -np.ones(np.shape(keys), dtype=np.int64)
+        found = known & (self.sorted_keys[position] == keys)
+        return np.where(found, self.key_order[position], -1)
+
+    def get_detected_photons(self, bands=None):
+        # detected photons of every starting level, per detection bands (nm; None: all fluorescence)
+        key = None if bands is None else tuple(map(tuple, bands))
+        if key not in self.photons:
+            detected = in_bands(np.asarray(self.dataset.spon['wavelength']), bands)
+            self.photons[key] = self.cascade.detected_photons(detected)
+        return self.photons[key]
+
+    def evaluate(self, ladder, two_mj, upper=None, powers=0.01, waists=100e-6, bands=None):
+        # figures of merit of a batch of schemes, in the order of the batch (see rank)
+        ladder, two_mj = np.atleast_2d(ladder).astype(np.int64), np.atleast_2d(two_mj).astype(np.int64)
+        n_schemes, n_levels = ladder.shape
+        n_steps = n_levels - 1
+        if upper is None:
+            upper = -np.ones(n_schemes, dtype=np.int64)
+        upper = np.broadcast_to(np.asarray(upper, dtype=np.int64), (n_schemes,))
+
+        steps = (ladder[:, :-1] >= 0) & (ladder[:, 1:] >= 0)
+        rows = self.get_rows(ladder[:, :-1], two_mj[:, :-1], ladder[:, 1:], two_mj[:, 1:])
+        powers = np.broadcast_to(get_step_values(powers, n_steps), (n_schemes, n_steps))
+        waists = np.broadcast_to(get_step_values(waists, n_steps), (n_schemes, n_steps))
+        rabi = np.where(rows >= 0, get_rabi_frequency(self.dipole[rows], powers, waists), 0.0)
+        rabi[~steps] = np.nan
+
+        n_valid = steps.sum(axis=1)
+        # levels of a ladder are contiguous from the ground state, and every step is an absorption row
+        valid = (n_valid > 0) & (n_valid == np.cumprod(steps, axis=1).sum(axis=1)) & \
+            np.all((rows >= 0) | ~steps, axis=1)
+        top = ladder[np.arange(n_schemes), n_valid]
+        start = np.where(upper >= 0, upper, top)
+
+        levels = np.concatenate([ladder[:, 1:], upper[:, None]], axis=1)
+        lifetime = np.where(levels >= 0, self.lifetime[np.maximum(levels, 0)], np.inf).min(axis=1)
+
+        results = np.zeros(n_schemes, dtype=[('scheme', 'i8'), ('valid', '?'), ('score', 'f8'), ('min_rabi', 'f8'),
+                                             ('detected', 'f8'), ('lifetime', 'f8'), ('hops', 'i8'),
+                                             ('rabi', 'f8', (n_steps,)), ('rows', 'i8', (n_steps,))])
+        results['scheme'] = np.arange(n_schemes)
+        results['valid'] = valid
+        results['rabi'] = rabi
+        results['rows'] = rows
+        results['hops'] = n_valid
+        # a batch without steps (no ladder found) has no valid scheme
+        results['min_rabi'] = np.where(valid, np.where(steps, rabi, np.inf).min(axis=1, initial=np.inf), 0.0)
+        results['detected'] = np.where(start >= 0, self.get_detected_photons(bands)[np.maximum(start, 0)], 0.0)
+        results['lifetime'] = lifetime
+        results['score'] = np.where(valid, results['min_rabi'] * results['detected'], 0.0)
+        return results
+
+    def rank(self, results, key='score'):
+        # results by decreasing key, valid schemes first
+        order = np.lexsort((-results[key], ~results['valid']))
+        return results[order]
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# the modules are at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import make_dataset
+from dataset import Dataset
+
+N_MAX = 9
+
+@pytest.fixture(scope='session')
+def synthetic_directory(tmp_path_factory):
+    # the data files of benchmark.SyntheticAtom up to N_MAX, generated without ARC
+    directory = str(tmp_path_factory.mktemp('synthetic'))
+    make_dataset(directory, N_MAX, processes=1)
+    return directory
+
+@pytest.fixture(scope='session')
+def synthetic_dataset(synthetic_directory):
+    return Dataset(synthetic_directory)
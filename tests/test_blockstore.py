@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from blockstore import BlockStore, fcntl
+
+PARAMS = {'atom': 'SyntheticAtom', 'q': 1}
+
+def write_chunk(store, name):
+    with open(store.get_chunk_path(name), 'wb') as f:
+        f.write(b'1 2 3\n')
+
+def test_unlisted_chunks_of_an_interrupted_run_are_removed(tmp_path):
+    store = BlockStore(str(tmp_path), 'levels', PARAMS)
+    write_chunk(store, 'listed.dat')
+    write_chunk(store, 'interrupted.dat')
+    store.add_chunk('listed.dat', [((5, 0), 0, 6, 1)])
+    store.checkpoint()
+    store.close()
+    store = BlockStore(str(tmp_path), 'levels', PARAMS)
+    store.close()
+    assert sorted(os.listdir(store.directory)) == ['listed.dat', 'lock', 'manifest.json']
+    assert store.blocks == {(5, 0): ('listed.dat', 0, 6, 1)}
+
+@pytest.mark.skipif(fcntl is None, reason='no lock of the store')
+def test_chunks_of_an_active_run_are_kept(tmp_path):
+    active = BlockStore(str(tmp_path), 'levels', PARAMS)
+    write_chunk(active, 'in-flight.dat')
+    other = BlockStore(str(tmp_path), 'levels', PARAMS)
+    other.close()
+    assert os.path.exists(active.get_chunk_path('in-flight.dat'))
+    active.add_chunk('in-flight.dat', [((5, 0), 0, 6, 1)])
+    active.checkpoint()
+    active.close()
+    assert BlockStore(str(tmp_path), 'levels', PARAMS).blocks == {(5, 0): ('in-flight.dat', 0, 6, 1)}
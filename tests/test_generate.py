@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmark import SyntheticAtom
+from generate import generate, get_j_list, get_dipole_moment, check_spontaneous_transition_rule, \
+    ABSP_FORMAT, SPON_FORMAT, LEVL_FORMAT, DIPOLE_CUTOFF, RATE_CUTOFF
+
+N_START, N_MAX, L_MAX = 5, 9, 4
+
+# the serial loops of the notebook (main.ipynb), which the pooled generator must reproduce byte for byte
+
+def serial_levels(atom):
+    lines = []
+    for n in range(N_START, N_MAX):
+        for l in range(0, L_MAX):
+            for j in get_j_list(l):
+                lines.append(LEVL_FORMAT % (n, l, j, atom.getEnergy(n, l, j), atom.getStateLifetime(n, l, j)/1e-9))
+    return lines
+
+def serial_absorption(atom, q=+1):
+    lines = []
+    for n1 in range(N_START, N_MAX):
+        for l1 in range(0, L_MAX):
+            for n2 in range(n1, N_MAX):
+                for l2 in range(0, L_MAX):
+                    if n1 == n2 and l1 == l2:
+                        continue
+                    for j1 in get_j_list(l1):
+                        for j2 in get_j_list(l2):
+                            frequency = atom.getTransitionFrequency(n1, l1, j1, n2, l2, j2) / 1e12
+                            for mj1 in np.arange(-j1, j1+1, 1):
+                                for mj2 in np.arange(-j2, j2+1, 1):
+                                    if frequency > 0:
+                                        dipole = get_dipole_moment(atom, n1, l1, j1, mj1, n2, l2, j2, mj2, q)
+                                    else:
+                                        dipole = get_dipole_moment(atom, n2, l2, j2, mj2, n1, l1, j1, mj1, -q)
+                                    if np.abs(dipole) > DIPOLE_CUTOFF:
+                                        wavelength = atom.getTransitionWavelength(n1, l1, j1, n2, l2, j2)/1e-9
+                                        lines.append(ABSP_FORMAT % (n1, l1, j1, mj1, n2, l2, j2, mj2,
+                                                                    frequency, wavelength, dipole))
+    return lines
+
+def serial_spontaneous(atom, temperature=300):
+    lines = []
+    for n1 in range(N_START, N_MAX):
+        for n2 in range(N_START, N_MAX):
+            for l1 in range(0, L_MAX):
+                for l2 in range(0, L_MAX):
+                    for j1 in get_j_list(l1):
+                        for j2 in get_j_list(l2):
+                            if n1 == n2 and l1 == l2 and abs(j1-j2) < 1e-9:
+                                continue
+                            frequency = atom.getTransitionFrequency(n1, l1, j1, n2, l2, j2)/1e12
+                            if frequency < 0 and check_spontaneous_transition_rule(l1, l2, j1, j2) > 0:
+                                rate = atom.getTransitionRate(n1, l1, j1, n2, l2, j2, temperature=temperature)
+                                if rate > RATE_CUTOFF:
+                                    wavelength = atom.getTransitionWavelength(n1, l1, j1, n2, l2, j2)/1e-9
+                                    lines.append(SPON_FORMAT % (n1, l1, j1, n2, l2, j2, -frequency, -wavelength, rate))
+    return lines
+
+SERIAL = {'levels': serial_levels, 'absorption': serial_absorption, 'spontaneous': serial_spontaneous}
+
+@pytest.mark.parametrize('stage, method', [('levels', 'mj'), ('absorption', 'mj'), ('absorption', 'reduced'),
+                                           ('spontaneous', 'mj')])
+def test_pooled_output_matches_serial_loops(tmp_path, stage, method):
+    output = os.path.join(str(tmp_path), stage + '.dat')
+    generate(stage, output, 'benchmark.SyntheticAtom', N_START, N_MAX, L_MAX, method=method, processes=2,
+             rebuild=True, cache=None, binary=False, verbose=False)
+    with open(output, 'rb') as f:
+        pooled = f.read()
+    serial = ''.join(SERIAL[stage](SyntheticAtom())).encode()
+    assert len(serial) > 0
+    assert pooled == serial
+
+def test_incremental_output_matches_serial_loops(tmp_path):
+    # blocks of a smaller run are reused by a larger one, which still gives the file of the serial loops
+    output = os.path.join(str(tmp_path), 'absorption.dat')
+    generate('absorption', output, 'benchmark.SyntheticAtom', N_START, N_MAX - 2, L_MAX, processes=2,
+             cache=None, binary=False, verbose=False)
+    generate('absorption', output, 'benchmark.SyntheticAtom', N_START, N_MAX, L_MAX, processes=2,
+             cache=None, binary=False, verbose=False)
+    with open(output, 'rb') as f:
+        assert f.read() == ''.join(serial_absorption(SyntheticAtom())).encode()
+
+def test_unknown_atom_fails_before_the_pool(tmp_path):
+    output = os.path.join(str(tmp_path), 'levels.dat')
+    with pytest.raises(ValueError):
+        generate('levels', output, 'benchmark.NoSuchAtom', N_START, N_MAX, L_MAX, processes=2, cache=None, verbose=False)
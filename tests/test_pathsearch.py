@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from pathsearch import PathSearch, in_bands
+
+def enumerate_ladders(search, state_id, two_mj, max_hops, bands):
+    # products of |dipole| of all the ladders from the ground state to (state_id, mj), best first
+    absp = search.dataset.absp
+    products = []
+    def extend(sid, tmj, rows):
+        if sid == search.ground and rows:
+            products.append(float(np.prod(np.abs(absp['dipole'][list(rows)]))))
+            return
+        if len(rows) >= max_hops:
+            return
+        edges = search.dataset.get_absorption_rows_to(sid, tmj)
+        edges = edges[in_bands(absp['wavelength'][edges], bands) & np.isfinite(search.exci_cost[edges])]
+        for row in edges.tolist():
+            extend(int(absp['lower'][row]), int(absp['two_mj_lower'][row]), rows + (row,))
+    extend(state_id, two_mj, ())
+    return sorted(products, reverse=True)
+
+def enumerate_cascades(search, state_id, max_hops):
+    # branching ratios of all the cascades from state_id to the ground state, best first
+    spon = search.dataset.spon
+    ratios = []
+    def extend(sid, rows):
+        if sid == search.ground and rows:
+            ratios.append(float(np.prod(search.branching[list(rows)])))
+            return
+        if len(rows) >= max_hops:
+            return
+        edges = search.dataset.get_spontaneous_rows_from(sid)
+        for row in edges[np.isfinite(search.spon_cost[edges])].tolist():
+            extend(int(spon['lower'][row]), rows + (row,))
+    extend(state_id, ())
+    return sorted(ratios, reverse=True)
+
+@pytest.mark.parametrize('max_hops', [2, 4])
+@pytest.mark.parametrize('bands', [None, [(400, 2000)]])
+def test_excitation_paths_match_enumeration(synthetic_dataset, max_hops, bands):
+    search = PathSearch(synthetic_dataset)
+    absp = synthetic_dataset.absp
+    for state_id, two_mj in sorted(set(zip(absp['upper'].tolist(), absp['two_mj_upper'].tolist()))):
+        results = search.search_excitation_paths(state_id, two_mj, k=5, max_hops=max_hops, bands=bands)
+        products = [product for product, _ in results]
+        assert np.allclose(products, enumerate_ladders(search, state_id, two_mj, max_hops, bands)[:5], rtol=1e-9)
+        for product, rows in results:
+            assert len(rows) <= max_hops
+            assert product == pytest.approx(np.prod(np.abs(absp['dipole'][rows])))
+
+@pytest.mark.parametrize('max_hops', [2, 4])
+def test_fluorescence_paths_match_enumeration(synthetic_dataset, max_hops):
+    search = PathSearch(synthetic_dataset)
+    for state_id in np.unique(synthetic_dataset.spon['upper']).tolist():
+        ratios = [ratio for ratio, _ in search.search_fluorescence_paths(state_id, k=5, max_hops=max_hops)]
+        assert np.allclose(ratios, enumerate_cascades(search, state_id, max_hops)[:5], rtol=1e-9)
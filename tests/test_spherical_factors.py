@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from generate import get_spherical_factors, get_j_list
+
+wigner = pytest.importorskip('sympy.physics.wigner')
+from sympy import Rational
+
+def half(x):
+    return Rational(int(round(2*x)), 2)
+
+def get_reference_factor(j1, mj1, j2, q):
+    # (-1)**(j1-mj1) * Wigner3j(j1, 1, j2, -mj1, -q, mj2), as in ARC's getDipoleMatrixElement
+    mj2 = mj1 + q
+    if abs(mj2) > j2:
+        return 0.0
+    sign = (-1)**int(round(j1 - mj1))
+    return sign * float(wigner.wigner_3j(half(j1), 1, half(j2), -half(mj1), -q, half(mj2)))
+
+@pytest.mark.parametrize('q', [-1, 0, 1])
+@pytest.mark.parametrize('l1', range(0, 6))
+def test_spherical_factors_match_wigner_3j(l1, q):
+    for j1 in get_j_list(l1):
+        mj1 = np.arange(-j1, j1+1, 1)
+        # j2 = j1 - 1, j1, j1 + 1, and a j2 that rank 1 cannot couple to j1
+        for j2 in [j1 - 1, j1, j1 + 1, j1 + 2]:
+            if j2 < 0.5:
+                continue
+            factors = get_spherical_factors(j1, mj1, j2, q)
+            reference = [get_reference_factor(j1, m, j2, q) for m in mj1]
+            assert np.allclose(factors, reference, rtol=1e-12, atol=1e-14), (j1, j2, q)
+
+@pytest.mark.parametrize('q', [-2, 2, 0.5])
+def test_spherical_factors_reject_invalid_polarization(q):
+    with pytest.raises(ValueError):
+        get_spherical_factors(1.5, np.array([0.5]), 2.5, q)
@@ -0,0 +1,115 @@
+import numpy as np
+
+import instrument
+from datafile import CHUNK_ROWS
+
+# Streaming queries over the transitions of a Dataset.
+#
+# A query is a set of predicates on the rows of "absorption.ids.npy" or "spontaneous.ids.npy". They are
+# evaluated chunk by chunk on the memory-mapped file, and only the matching rows are copied, so that
+# memory is bounded by the size of the result and of one chunk, not by the size of the file. When the
+# Dataset has its indexes, a frequency window or a given upper level only reads the candidate rows of
+# the index instead of scanning the whole file.
+#
+#### Predicates ####
+# n, l                         - (min, max) of both levels, inclusive
+# n_lower, n_upper, l_lower, l_upper - (min, max) of one level, inclusive
+# freq (THz), wavelength (nm)  - (min, max), exclusive as the THz window of path-select.py
+# min_dipole (a0*e)            - |dipole| > min_dipole, absorption only
+# min_rate (s^-1)              - rate > min_rate, spontaneous only
+# lower, upper                 - state ID or list of state IDs of one level
+# states                       - list of state IDs, of either level
+# two_mj_lower, two_mj_upper   - 2*mj of one level, absorption only
+
+def in_range(values, bounds, inclusive=True):
+    lower, upper = bounds
+    if inclusive:
+        return (values >= lower) & (values <= upper)
+    return (values > lower) & (values < upper)
+
+class TransitionStore():
+
+    def __init__(self, dataset, kind='absorption', chunk_rows=CHUNK_ROWS):
+        if kind not in ['absorption', 'spontaneous']:
+            raise ValueError('unknown kind of transitions: ' + kind)
+        self.dataset = dataset
+        self.kind = kind
+        self.data = dataset.absp if kind == 'absorption' else dataset.spon
+        self.chunk_rows = chunk_rows
+        # the state table is small, its quantum numbers are kept in memory for the joins
+        self.n = np.asarray(dataset.states['n'])
+        self.l = np.asarray(dataset.states['l'])
+
+    def get_candidates(self, freq, upper, two_mj_upper):
+        # rows to read from an index of the Dataset, in file order, or None for a full scan
+        if self.kind == 'absorption':
+            if np.isscalar(upper) and two_mj_upper is not None and hasattr(self.dataset, 'absp_by_upper'):
+                return self.dataset.get_absorption_rows_to(int(upper), int(two_mj_upper))
+            if freq is not None and hasattr(self.dataset, 'absp_by_freq'):
+                return self.dataset.get_absorption_rows_in_window(*freq)
+        elif np.isscalar(upper) and hasattr(self.dataset, 'spon_by_upper'):
+            return self.dataset.get_spontaneous_rows_from(int(upper))
+        return None
+
+    def get_mask(self, chunk, n, l, n_lower, n_upper, l_lower, l_upper, freq, wavelength,
+                 min_dipole, min_rate, lower, upper, states, two_mj_lower, two_mj_upper):
+        mask = np.ones(len(chunk), dtype=bool)
+        if freq is not None:
+            mask &= in_range(chunk['freq'], freq, inclusive=False)
+        if wavelength is not None:
+            mask &= in_range(chunk['wavelength'], wavelength, inclusive=False)
+        if min_dipole is not None:
+            mask &= np.abs(chunk['dipole']) > min_dipole
+        if min_rate is not None:
+            mask &= chunk['rate'] > min_rate
+        if two_mj_lower is not None:
+            mask &= chunk['two_mj_lower'] == two_mj_lower
+        if two_mj_upper is not None:
+            mask &= chunk['two_mj_upper'] == two_mj_upper
+        if lower is not None:
+            mask &= np.isin(chunk['lower'], lower)
+        if upper is not None:
+            mask &= np.isin(chunk['upper'], upper)
+        if states is not None:
+            mask &= np.isin(chunk['lower'], states) | np.isin(chunk['upper'], states)
+        # quantum numbers, joined from the state table
+        for numbers, both, on_lower, on_upper in [(self.n, n, n_lower, n_upper), (self.l, l, l_lower, l_upper)]:
+            for level, bounds in [('lower', on_lower), ('upper', on_upper), ('lower', both), ('upper', both)]:
+                if bounds is not None:
+                    mask &= in_range(numbers[chunk[level]], bounds)
+        return mask
+
+    def query(self, n=None, l=None, n_lower=None, n_upper=None, l_lower=None, l_upper=None, freq=None,
+              wavelength=None, min_dipole=None, min_rate=None, lower=None, upper=None, states=None,
+              two_mj_lower=None, two_mj_upper=None):
+        # generator of (rows, transitions) of the matching rows, chunk by chunk, in file order
+        if self.kind == 'absorption' and min_rate is not None:
+            raise ValueError('min_rate applies to spontaneous radiation')
+        if self.kind == 'spontaneous' and (min_dipole is not None or two_mj_lower is not None or two_mj_upper is not None):
+            raise ValueError('min_dipole and two_mj apply to absorption')
+        predicates = (n, l, n_lower, n_upper, l_lower, l_upper, freq, wavelength,
+                      min_dipole, min_rate, lower, upper, states, two_mj_lower, two_mj_upper)
+        candidates = self.get_candidates(freq, upper, two_mj_upper)
+        n_rows = len(self.data) if candidates is None else len(candidates)
+        for i in range(0, n_rows, self.chunk_rows):
+            if candidates is None:
+                rows = np.arange(i, min(i+self.chunk_rows, n_rows))
+                chunk = self.data[i:i+self.chunk_rows]
+            else:
+                rows = candidates[i:i+self.chunk_rows]
+                chunk = self.data[rows]
+            mask = self.get_mask(chunk, *predicates)
+            if mask.any():
+                yield rows[mask], np.array(chunk[mask])
+
+    def select(self, **predicates):
+        # all the matching rows at once: (rows, transitions)
+        with instrument.timer('query.' + self.kind, predicates=sorted(k for k, v in predicates.items() if v is not None)) as fields:
+            results = list(self.query(**predicates))
+            if not results:
+                rows, chunks = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=self.data.dtype)
+            else:
+                rows, chunks = zip(*results)
+                rows, chunks = np.concatenate(rows), np.concatenate(chunks)
+            fields['rows'] = len(rows)
+        return rows, chunks